@@ -2,37 +2,136 @@ from absl import logging
 import numpy as np
 
 
+def stream_seed(rng):
+    # entropy from which the reward streams of all arms of a bandit are derived,
+    # taken from the global numpy state when no generator is given so that
+    # np.random.seed() keeps the runs reproducible
+    if rng is None:
+        return int(np.random.randint(2 ** 31))
+    return int(rng.integers(2 ** 63))
+
+
+class RewardStream():
+    """
+    Rewards of one arm pre-drawn in blocks from its own generator. The n-th pull
+    of the arm always gets the n-th reward of the stream, whether the arm is
+    pulled one at a time or many at a time.
+    """
+
+    def __init__(self, draw, seed, block=1024):
+        self.__draw = draw
+        self.__seed = seed
+        self.__rng = None
+        self.__block = block
+        self.__values = []
+        self.__pos = 0
+
+    def rewind(self):
+        """restart the stream from its first reward"""
+        self.__rng = None
+        self.__values = []
+        self.__pos = 0
+
+    def __refill(self, size):
+        if self.__rng is None:
+            self.__rng = np.random.default_rng(self.__seed)
+        blocks = -(-size // self.__block)
+        self.__values = self.__draw(self.__rng, blocks * self.__block).tolist()
+        self.__pos = 0
+
+    def next(self):
+        """get the reward of the next pull"""
+        if self.__pos == len(self.__values):
+            self.__refill(1)
+        self.__pos += 1
+        return self.__values[self.__pos - 1]
+
+    def take(self, size):
+        """get the rewards of the next size pulls in a list"""
+        values = self.__values[self.__pos:self.__pos + size]
+        self.__pos += len(values)
+        if len(values) < size:
+            rest = size - len(values)
+            self.__refill(rest)
+            values += self.__values[:rest]
+            self.__pos = rest
+        return values
+
+
 class BernoulliBandit():
     """
-    The class of a bandit with Bernoulli arm indexed by 1 and 2
+    The class of a bandit with Bernoulli arms indexed by 1 to K, whose true
+    means are the arguments mus. Rewards of every arm are drawn in blocks of
+    the given size from its own stream, derived from the generator rng.
     """
 
-    def __init__(self, mu_1, mu_2):
-        self.__mu_1, self.__mu_2 = mu_1, mu_2
+    def __init__(self, *mus, rng=None, block=1024):
+        if len(mus) < 2:
+            logging.fatal('The number of arms should be at least two!')
+        self.__mus = mus
+        seed = stream_seed(rng)
+        self.__streams = [RewardStream(lambda g, size, mu=mu: g.binomial(1, mu, size),
+                                       np.random.SeedSequence(seed, spawn_key=(i,)), block)
+                          for i, mu in enumerate(mus)]
 
     def init(self):
         self.tot_samples = 0
 
+    def rewind(self):
+        """replay the reward tapes of all arms from the first pull"""
+        for stream in self.__streams:
+            stream.rewind()
+
+    @property
+    def mus(self):
+        return self.__mus
+
+    @property
+    def arm_num(self):
+        return len(self.__mus)
+
+    def tapes(self, size):
+        """get the rewards of the first size pulls of every arm, an array of shape (K, size)"""
+        self.rewind()
+        tapes = np.array([stream.take(size) for stream in self.__streams])
+        self.rewind()
+        return tapes
+
     def pull_arm(self, index):
-        if index not in [1, 2]:
+        if not 1 <= index <= len(self.__streams):
             logging.fatal('Wrong Arm Index!')
         self.tot_samples += 1
-        if index == 1:
-            return np.random.binomial(1, self.__mu_1, 1)[0]
-        return np.random.binomial(1, self.__mu_2, 1)[0]
+        return self.__streams[index - 1].next()
+
+    def pull_many(self, indices):
+        """pull the arms in indices one after another and return an array of rewards"""
+        indices = np.asarray(indices)
+        if len(indices) and not (indices.min() >= 1 and indices.max() <= len(self.__streams)):
+            logging.fatal('Wrong Arm Index!')
+        self.tot_samples += len(indices)
+        rewards = np.zeros(len(indices), dtype=np.int64)
+        # only the streams of the pulled arms are touched
+        for arm in np.unique(indices).tolist():
+            mask = indices == arm
+            rewards[mask] = self.__streams[arm - 1].take(int(mask.sum()))
+        return rewards
 
     def regret(self, rewards):
-        return self.tot_samples * max(self.__mu_1, self.__mu_2) - rewards
+        return self.tot_samples * max(self.__mus) - rewards
 
 
 class GaussianArm():
     """
-    gaussian arm
+    gaussian arm, rewards are drawn in blocks from its own stream seeded by rng
+    (a generator, a seed or a SeedSequence)
     """
 
-    def __init__(self, mu, sigma=1):
+    def __init__(self, mu, sigma=1, rng=None, block=1024):
         self.__mu = mu
         self.__sigma = sigma
+        if rng is None or isinstance(rng, np.random.Generator):
+            rng = stream_seed(rng)
+        self.__stream = RewardStream(lambda g, size: g.normal(mu, sigma, size), rng, block)
 
     @property
     def mean(self):
@@ -42,28 +141,40 @@ class GaussianArm():
     def std(self):
         return self.__sigma
 
+    def rewind(self):
+        """replay the rewards from the first pull"""
+        self.__stream.rewind()
+
     def pull(self):
-        """return a numpy array of stochastic rewards"""
-        return np.random.normal(self.__mu, self.__sigma, 1)[0]
+        """return one stochastic reward"""
+        return self.__stream.next()
+
+    def pull_many(self, size):
+        """return a list of size stochastic rewards"""
+        return self.__stream.take(size)
 
 
 class LinearBandit():
     """
     Linear Bandit Class
-    Arms are numbered by 0 to len(contexts)-1 by default.
+    Arms are numbered by 0 to len(contexts)-1 by default. Every arm draws its
+    rewards in blocks from its own stream, derived from the generator rng.
     """
 
-    def __init__(self, contexts, theta):
+    def __init__(self, contexts, theta, rng=None, block=1024):
         if len(contexts) < 2:
             logging.fatal('The number of arms should be at least two!')
-        if not isinstance(contexts, list):
-            logging.fatal('Features should be given in a list!')
-        self.__contexts = [np.array(context) for context in contexts]
-        self.__theta = np.array(theta)
-        for _, context in enumerate(self.__contexts):
-            if context.shape != self.__theta.shape:
-                logging.fatal('The context and theta dimensions are unequal!')
-        arms = [GaussianArm(np.dot(context, theta)) for context in self.__contexts]
+        if not isinstance(contexts, (list, np.ndarray)):
+            logging.fatal('Features should be given in a list or an array!')
+        self.__theta = np.asarray(theta)
+        if self.__theta.ndim != 1 or np.ndim(contexts) != 2 or np.shape(contexts)[1] != len(self.__theta):
+            logging.fatal('The context and theta dimensions are unequal!')
+        self.__contexts = list(np.asarray(contexts))
+        # means of all arms are computed by one matrix-vector product
+        means = np.asarray(contexts) @ self.__theta
+        seed = stream_seed(rng)
+        arms = [GaussianArm(mean, rng=np.random.SeedSequence(seed, spawn_key=(i,)), block=block)
+                for i, mean in enumerate(means)]
         self.__arms = arms
         self.__arm_num = len(arms)
         self.__best_arm_ind = max([(tup[0], tup[1].mean) for tup in enumerate(self.__arms)], key=lambda x: x[1])[0]
@@ -79,6 +190,20 @@ class LinearBandit():
         self.tot_samples += 1
         return self.__arms[index].pull()
 
+    def pull_many(self, indices):
+        """pull the arms in indices one after another and return an array of rewards"""
+        indices = np.asarray(indices)
+        if len(indices) and (indices.min() < 0 or indices.max() >= self.__arm_num):
+            logging.fatal('Wrong arm index!')
+        self.tot_samples += len(indices)
+        # group the pulls by arm, keeping their order within every arm
+        order = np.argsort(indices, kind='stable')
+        arms, counts = np.unique(indices, return_counts=True)
+        rewards = np.zeros(len(indices))
+        rewards[order] = [reward for arm, count in zip(arms, counts)
+                          for reward in self.__arms[arm].pull_many(int(count))]
+        return rewards
+
     @property
     def all_arm(self):
         return self.__arms
@@ -87,5 +212,161 @@ class LinearBandit():
     def contexts(self):
         return self.__contexts
 
+    @property
+    def dim(self):
+        return len(self.__theta)
+
     def regret(self, rewards):
         return self.tot_samples * self.__best_arm.mean - rewards
+
+
+class ArrayLinearBandit():
+    """
+    Linear bandit holding the contexts as one (K, d) array and the means and
+    standard deviations of the gaussian arms as vectors, for large numbers of
+    arms. Arms are numbered by 0 to K-1. Standard normal noise is drawn in
+    blocks from one stream derived from the generator rng, the n-th pull of
+    the bandit getting the n-th draw whichever arm it pulls, so pull_many()
+    gives the same rewards as pulling one arm after another. The expected
+    (pseudo) regret is accumulated with every pull.
+    """
+
+    def __init__(self, contexts, theta, rng=None, block=1024, sigma=1):
+        contexts = np.asarray(contexts, dtype=np.float64)
+        theta = np.asarray(theta, dtype=np.float64)
+        if contexts.ndim != 2 or len(contexts) < 2:
+            logging.fatal('Features should be given as an array of at least two arms!')
+        if theta.ndim != 1 or contexts.shape[1] != len(theta):
+            logging.fatal('The context and theta dimensions are unequal!')
+        self.__contexts = contexts
+        self.__theta = theta
+        self.__means = contexts @ theta
+        self.__stds = np.broadcast_to(np.asarray(sigma, dtype=np.float64), self.__means.shape)
+        self.__best_arm_ind = int(self.__means.argmax())
+        self.__gaps = self.__means[self.__best_arm_ind] - self.__means
+        self.__means_list = self.__means.tolist()
+        self.__stds_list = self.__stds.tolist()
+        self.__gaps_list = self.__gaps.tolist()
+        self.__noise = RewardStream(lambda g, size: g.standard_normal(size), stream_seed(rng), block)
+
+    def init(self):
+        self.tot_samples = 0
+        self.pseudo_regret = 0
+
+    def rewind(self):
+        """replay the noise from the first pull"""
+        self.__noise.rewind()
+
+    def pull_arm(self, index):
+        if not 0 <= index < len(self.__means_list):
+            logging.fatal('Wrong arm index!')
+        self.tot_samples += 1
+        self.pseudo_regret += self.__gaps_list[index]
+        return self.__means_list[index] + self.__stds_list[index] * self.__noise.next()
+
+    def pull_many(self, indices):
+        """pull the arms in indices one after another and return an array of rewards"""
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self.__means)):
+            logging.fatal('Wrong arm index!')
+        self.tot_samples += len(indices)
+        self.pseudo_regret += float(self.__gaps[indices].sum())
+        return self.__means[indices] + self.__stds[indices] * np.array(self.__noise.take(len(indices)))
+
+    @property
+    def means(self):
+        return self.__means
+
+    @property
+    def stds(self):
+        return self.__stds
+
+    @property
+    def best_arm(self):
+        return self.__best_arm_ind
+
+    @property
+    def contexts(self):
+        return self.__contexts
+
+    @property
+    def dim(self):
+        return len(self.__theta)
+
+    def regret(self, rewards):
+        return self.tot_samples * self.__means_list[self.__best_arm_ind] - rewards
+
+
+class CatalogueBandit():
+    """
+    Linear bandit over a catalogue of items (one context per row, numbered by
+    0 to N-1) where every round offers its own candidates: round() draws
+    candidates items uniformly, or offers the whole catalogue (None) when
+    candidates is 0, and the regret is taken to the best candidate of every
+    round. Items can be replaced between rounds, and gaussian noise is drawn
+    in blocks from one stream derived from the generator rng.
+    """
+
+    def __init__(self, items, theta, rng=None, candidates=0, block=1024, sigma=1):
+        items = np.array(items)
+        theta = np.asarray(theta, dtype=np.float64)
+        if items.ndim != 2 or len(items) < 2:
+            logging.fatal('Items should be given as an array of at least two items!')
+        if items.shape[1] != len(theta):
+            logging.fatal('The context and theta dimensions are unequal!')
+        self.__items = items
+        self.__theta = theta
+        self.__means = items @ theta
+        self.__best = float(self.__means.max())
+        self.__candidates = candidates
+        self.__sigma = sigma
+        self.__rng = np.random.default_rng() if rng is None else rng
+        self.__noise = RewardStream(lambda g, size: g.standard_normal(size), stream_seed(self.__rng), block)
+        self.__round_ids = None
+        self.__round_best = self.__best
+
+    def init(self):
+        self.tot_samples = 0
+        self.pseudo_regret = 0
+        self.__best_rewards = 0
+
+    @property
+    def items(self):
+        return self.__items
+
+    @property
+    def dim(self):
+        return len(self.__theta)
+
+    def round(self):
+        """draw the candidates of the next round, None for the whole catalogue"""
+        if not self.__candidates:
+            self.__round_ids = None
+            self.__round_best = self.__best
+            return None
+        ids = self.__rng.integers(len(self.__items), size=self.__candidates)
+        self.__round_ids = ids
+        self.__round_best = float(self.__means[ids].max())
+        return ids
+
+    def replace(self, ids, vectors):
+        """replace the contexts of the items ids, e.g. as the catalogue changes"""
+        self.__items[ids] = vectors
+        self.__means[ids] = self.__items[ids] @ self.__theta
+        self.__best = float(self.__means.max())
+        # the best candidate of the current round may have changed too
+        if self.__round_ids is None:
+            self.__round_best = self.__best
+        elif np.isin(self.__round_ids, ids).any():
+            self.__round_best = float(self.__means[self.__round_ids].max())
+
+    def pull_arm(self, item):
+        if not 0 <= item < len(self.__means):
+            logging.fatal('Wrong item index!')
+        self.tot_samples += 1
+        self.pseudo_regret += self.__round_best - self.__means[item]
+        self.__best_rewards += self.__round_best
+        return float(self.__means[item]) + self.__sigma * self.__noise.next()
+
+    def regret(self, rewards):
+        return self.__best_rewards - rewards
@@ -0,0 +1,259 @@
+from abc import ABC, abstractmethod
+from absl import logging
+from utils import ArmStats
+import numpy as np
+
+
+class BatchBernoulliBandit():
+    """
+    A batch of independent Bernoulli bandits, one per trial (row). mus are the
+    true means shared by all rows, or one row of means per row of the batch
+    e.g. to sweep over environments, and arms are indexed by 0 to K-1. With
+    streams, pull_arm() draws only that many uniforms per step and row i uses
+    draw i % streams, so that rows of different configurations of a sweep see
+    the same reward stream in every trial.
+    """
+
+    # maximal number of uniforms compared at once by pull_arm_repeatedly()
+    BLOCK = 1 << 22
+
+    def __init__(self, mus, trials, rng=None, streams=None):
+        self.__mus = np.asarray(mus, dtype=float)
+        if self.__mus.shape[-1] < 2:
+            logging.fatal('The number of arms should be at least two!')
+        self.__row_mus = np.broadcast_to(self.__mus, (trials, self.__mus.shape[-1]))
+        self.__rows = np.arange(trials)
+        self.__trials = trials
+        self.__streams = trials if streams is None else streams
+        if trials % self.__streams:
+            logging.fatal('The number of rows should be a multiple of the number of streams!')
+        self.__rng = np.random.default_rng() if rng is None else rng
+
+    def init(self):
+        self.tot_samples = 0
+
+    @property
+    def mus(self):
+        return self.__mus
+
+    @property
+    def arm_num(self):
+        return self.__mus.shape[-1]
+
+    @property
+    def trials(self):
+        return self.__trials
+
+    @property
+    def rng(self):
+        return self.__rng
+
+    def pull_arm(self, actions):
+        """pull one arm in every trial, actions is an array of shape (trials,)"""
+        self.tot_samples += 1
+        draws = self.__rng.random(self.__streams)
+        if self.__streams < self.__trials:
+            draws = np.tile(draws, self.__trials // self.__streams)
+        return (draws < self.__row_mus[self.__rows, actions]).astype(np.int64)
+
+    def pull_arm_repeatedly(self, pulls):
+        """
+        pull arm k pulls[:, k] times in trial i and return the total rewards of
+        each arm, an array of the same shape as pulls. All trials are supposed
+        to pull the same number of times. With streams, the n-th of these pulls
+        of an arm is rewarded by the same uniform draw in all rows of a stream,
+        as by pull_arm().
+        """
+        self.tot_samples += int(pulls[0].sum())
+        if self.__streams == self.__trials:
+            return self.__rng.binomial(pulls, self.__row_mus)
+
+        # rows are grouped as (row // streams, stream), the draws of a block of
+        # pulls broadcasting over the groups
+        shape = (self.__trials // self.__streams, self.__streams, self.arm_num, 1)
+        row_pulls, row_mus = np.reshape(pulls, shape), self.__row_mus.reshape(shape)
+        rewards = np.zeros(shape[:-1], dtype=np.int64)
+        size = max(self.BLOCK // (self.__trials * self.arm_num), 1)
+        for start in range(0, int(np.max(pulls, initial=0)), size):
+            draws = self.__rng.random((self.__streams, self.arm_num, size))
+            pulled = np.arange(start, start + size) < row_pulls
+            rewards += ((draws < row_mus) & pulled).sum(axis=-1)
+        return rewards.reshape(np.shape(pulls))
+
+    def regret(self, rewards):
+        return self.tot_samples * self.__row_mus.max(axis=1) - rewards
+
+
+class BatchLearner(ABC):
+    """
+    Abstract basic class of learners running all trials at once. The empirical
+    information of arm k in trial i is kept in row i and column k of ArmStats.
+    """
+
+    @property
+    @abstractmethod
+    def name(self):
+        pass
+
+    @abstractmethod
+    def choice(self, time):
+        pass
+
+    def init(self, trials, arm_num, rng):
+        self._rows = np.arange(trials)
+        self._arm_num = arm_num
+        self._rng = rng
+        self._stats = ArmStats((trials, arm_num))
+
+    def update(self, rewards, actions):
+        self._stats.update((self._rows, actions), rewards, rewards == 1)
+
+    def _round_robin(self, time):
+        """pull every arm once at the beginning, return None afterwards"""
+        if time <= self._arm_num:
+            return np.full(len(self._rows), time - 1)
+        return None
+
+
+class BatchGreedy(BatchLearner):
+    """
+    Naive greedy policy for all trials at once
+    """
+
+    @property
+    def name(self):
+        return 'Greedy'
+
+    def choice(self, time):
+        actions = self._round_robin(time)
+        if actions is not None:
+            return actions
+        return np.argmax(self._stats.em_mean, axis=1)
+
+
+class BatchEpsGreedy(BatchLearner):
+    """
+    Greedy policy with epsilon exception for all trials at once, epsilon being
+    a number or an array with one value per trial
+    """
+
+    def __init__(self, epsilon):
+        self.__eps = epsilon
+
+    @property
+    def name(self):
+        return 'Epsilon-Greedy'
+
+    def choice(self, time):
+        actions = self._round_robin(time)
+        if actions is not None:
+            return actions
+        trials = len(self._rows)
+        explore = self._rng.random(trials) > (1 - self.__eps / time)
+        greedy = np.argmax(self._stats.em_mean, axis=1)
+        return np.where(explore, self._rng.integers(self._arm_num, size=trials), greedy)
+
+
+class BatchBerUCB(BatchLearner):
+    """
+    Upper Confidence Bound (UCB) policy for all trials at once, alpha being a
+    number or an array with one value per trial
+    """
+
+    def __init__(self, alpha):
+        # a column, so that every row of the statistics gets its own alpha
+        self.__alpha = np.asarray(alpha, dtype=float)[..., None]
+
+    @property
+    def name(self):
+        return 'UCB'
+
+    def choice(self, time):
+        actions = self._round_robin(time)
+        if actions is not None:
+            return actions
+        return np.argmax(self._stats.ucb(time, self.__alpha), axis=1)
+
+
+class BatchTS(BatchLearner):
+    """
+    Thompson sampling policy for all trials at once
+    """
+
+    @property
+    def name(self):
+        return 'TS'
+
+    def choice(self, time):
+        est = self._rng.beta(*self._stats.posterior())
+        return np.argmax(est, axis=1)
+
+
+class BatchExploreThenCommit(BatchLearner):
+    """
+    Explore-then-commit policy for all trials at once. The policy is not
+    progressive, so regrets of every horizon are computed separately by
+    regrets() rather than stepping through choice() and update(). C is a
+    number or an array with one value per trial.
+    """
+
+    def __init__(self, C):
+        self.__C = np.asarray(C, dtype=float)[..., None]
+
+    @property
+    def name(self):
+        return 'ExploreThenCommit'
+
+    def choice(self, time):
+        logging.fatal('ExploreThenCommit has to be evaluated by regrets()!')
+
+    def explore_pulls(self, horizon):
+        """number of exploration pulls of every arm for the given horizon, one row per value of C"""
+        trial_time = self.__C * np.power(horizon, 2 / 3)
+        bounds = np.ceil(trial_time * np.arange(self._arm_num + 1) / self._arm_num)
+        return np.diff(np.minimum(bounds, horizon)).astype(np.int64)
+
+    def regrets(self, bandit, horizons):
+        """return regrets of shape (trials, len(horizons)) with fresh samples per horizon"""
+        regrets = np.zeros((bandit.trials, len(horizons)))
+        for j, horizon in enumerate(horizons):
+            if horizon == 0:
+                continue
+            bandit.init()
+            pulls = np.broadcast_to(self.explore_pulls(horizon), (bandit.trials, self._arm_num))
+            rewards = bandit.pull_arm_repeatedly(pulls)
+            # arms left unexplored are never committed to, as in learner.py
+            em_mean = np.divide(rewards, pulls, out=np.full(pulls.shape, -np.inf), where=pulls > 0)
+            commit = np.argmax(em_mean, axis=1)
+            commit_pulls = np.zeros(pulls.shape, dtype=np.int64)
+            commit_pulls[self._rows, commit] = horizon - pulls.sum(axis=1)
+            rewards += bandit.pull_arm_repeatedly(commit_pulls)
+            regrets[:, j] = bandit.regret(rewards.sum(axis=1))
+        return regrets
+
+
+def simulate(policy, bandit, T, horizons):
+    """
+    run all trials of a policy on a batch bandit at once for T steps, return
+    the sorted horizons and the regrets of shape (trials, len(horizons))
+    """
+    horizons = np.asarray(horizons)
+    policy.init(bandit.trials, bandit.arm_num, bandit.rng)
+    if isinstance(policy, BatchExploreThenCommit):
+        return horizons, policy.regrets(bandit, horizons)
+
+    regrets = np.zeros((bandit.trials, len(horizons)))
+    bandit.init()
+    rewards = np.zeros(bandit.trials)
+    # play the steps between two horizons without checking for them
+    t = 0
+    for j, horizon in enumerate(horizons.tolist() + [T]):
+        for t in range(t + 1, horizon + 1):
+            actions = policy.choice(t)
+            reward = bandit.pull_arm(actions)
+            policy.update(reward, actions)
+            rewards += reward
+        t = horizon
+        if j < len(horizons):
+            regrets[:, j] = bandit.regret(rewards)
+    return horizons, regrets
@@ -0,0 +1,418 @@
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from absl import app
+from absl import logging
+from absl import flags
+from bandit import BernoulliBandit, LinearBandit, ArrayLinearBandit
+from experiment import play
+from learner import Greedy, EpsGreedy, ExploreThenCommit, BerUCB, TS, MultiUCB, LinUCB
+from mips import IVFIndex
+from snapshot import save_snapshot, load_snapshot
+from utils import sphere_sampling
+import numpy as np
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('bench', 'suite', 'name of the benchmark to run')
+flags.DEFINE_integer('rounds', 200, 'number of timed rounds per setting')
+flags.DEFINE_integer('armnum', 100, 'number of arms')
+flags.DEFINE_list('dims', ['3', '16', '64', '128', '256', '512'], 'dimensions of the contexts')
+flags.DEFINE_list('arm_nums', ['1000', '10000', '100000', '1000000'], 'numbers of arms for MultiUCB')
+flags.DEFINE_list('ber_arms', ['2', '4', '8', '16', '50', '500', '5000'], 'numbers of arms of the Bernoulli learners')
+flags.DEFINE_list('horizons', ['10000'], 'horizons of the learners in the suite')
+flags.DEFINE_list('suite_arms', ['10', '100', '1000'], 'numbers of arms of MultiUCB and LinearBandit in the suite')
+flags.DEFINE_list('suite_dims', ['3', '16', '64'], 'dimensions of LinUCB in the suite')
+flags.DEFINE_string('baseline', 'benchmark_baseline.json', 'json file of the baseline results of the suite')
+flags.DEFINE_boolean('update_baseline', False, 'overwrite the baseline with the results of this run')
+flags.DEFINE_string('results', None, 'json file to write the results of this run into')
+flags.DEFINE_float('threshold', 0.2, 'relative slowdown or memory growth reported as a regression')
+flags.DEFINE_list('feedback_every', ['1', '10', '100'], 'numbers of steps between two deliveries of rewards')
+flags.DEFINE_list('snapshot_arms', ['1000', '100000', '1000000'], 'numbers of arms of the MultiUCB snapshots')
+flags.DEFINE_list('mips_items', ['10000', '100000', '1000000'], 'numbers of items of the catalogues')
+flags.DEFINE_integer('mips_dim', 16, 'dimension of the items of the catalogues')
+flags.DEFINE_integer('mips_k', 100, 'number of items pre-filtered by the inner product index')
+flags.DEFINE_list('mips_probes', ['1', '4', '16', '64'], 'numbers of lists searched by the inner product index')
+flags.DEFINE_float('import_budget', 0.5, 'seconds the simulation core may take to import')
+flags.DEFINE_integer('import_runs', 5, 'number of fresh interpreters timing the import')
+flags.DEFINE_boolean('float32', False, 'use single precision contexts and LinUCB statistics')
+
+
+def time_rounds(policy, rounds, reward_fn):
+    # average wall time of one choice and one update of the policy
+    start = time.perf_counter()
+    for t in range(1, rounds + 1):
+        action = policy.choice(t)
+        policy.update(reward_fn(action), action)
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_linucb_dim():
+    # per-round latency of LinUCB as the dimension of the contexts grows
+    dtype = np.float32 if FLAGS.float32 else np.float64
+    for dim in [int(dim) for dim in FLAGS.dims]:
+        contexts = sphere_sampling(dim, FLAGS.armnum, dtype)
+        theta = sphere_sampling(dim, 1)[0]
+        means = contexts @ theta
+        policy = LinUCB(0.1, FLAGS.rounds, dtype)
+        policy.init(contexts)
+        latency = time_rounds(policy, FLAGS.rounds, lambda action: means[action] + np.random.normal())
+        logging.info('LinUCB dim=%d arms=%d: %.1f us per round' % (dim, FLAGS.armnum, latency * 1e6))
+
+
+def bench_multiucb_arms():
+    # per-decision latency of MultiUCB scanning all arms versus the UCB heap,
+    # measured after the initial round of pulling every arm once
+    for arm_num in [int(arm_num) for arm_num in FLAGS.arm_nums]:
+        means = np.random.normal(0, 0.3, arm_num)
+        reward_fn = lambda action: means[action] + np.random.normal()
+        for heap in [False, True]:
+            policy = MultiUCB(0.5, heap)
+            policy.init(means)
+            for t in range(1, arm_num + 1):
+                policy.update(reward_fn(t - 1), policy.choice(t))
+            start = time.perf_counter()
+            for t in range(arm_num + 1, arm_num + FLAGS.rounds + 1):
+                action = policy.choice(t)
+                policy.update(reward_fn(action), action)
+            latency = (time.perf_counter() - start) / FLAGS.rounds
+            logging.info('MultiUCB %s arms=%d: %.1f us per round'
+                         % ('heap' if heap else 'scan', arm_num, latency * 1e6))
+
+
+def bench_bernoulli_arms():
+    # per-decision latency of the K-armed Bernoulli learners, measured after
+    # the initial round of pulling every arm once. TS is timed with one
+    # vectorized posterior draw and with scalar draws per arm, which sets
+    # TS.SCALAR_ARMS.
+    for arm_num in [int(arm_num) for arm_num in FLAGS.ber_arms]:
+        means = np.random.random(arm_num)
+        reward_fn = lambda action: int(np.random.random() < means[action - 1])
+        T = arm_num + FLAGS.rounds
+        for name, make, init in [('Greedy', lambda: Greedy(arm_num), Greedy.init),
+                                 ('EpsGreedy', lambda: EpsGreedy(1, arm_num), EpsGreedy.init),
+                                 ('ExploreThenCommit', lambda: ExploreThenCommit(1, arm_num), lambda p: p.init(T)),
+                                 ('BerUCB', lambda: BerUCB(0.5, arm_num), BerUCB.init),
+                                 ('TS-vector', lambda: TS(arm_num), TS.init),
+                                 ('TS-scalar', lambda: TS(arm_num), TS.init)]:
+            policy = make()
+            init(policy)
+            if name.startswith('TS'):
+                policy.SCALAR_ARMS = arm_num if name == 'TS-scalar' else 0
+            for t in range(1, arm_num + 1):
+                policy.update(reward_fn(t), t)
+            start = time.perf_counter()
+            for t in range(arm_num + 1, T + 1):
+                action = policy.choice(t)
+                policy.update(reward_fn(action), action)
+            latency = (time.perf_counter() - start) / FLAGS.rounds
+            logging.info('%s arms=%d: %.1f us per round' % (name, arm_num, latency * 1e6))
+
+
+def bench_mips():
+    # decision latency of LinUCB over a whole catalogue, scoring every item
+    # versus pre-filtering through the inner product index, with the recall
+    # of the index (share of the exact top mips_k found) and the share of
+    # decisions agreeing with exhaustive scoring, on the same learner states
+    rng = np.random.default_rng(0)
+    dim, k = FLAGS.mips_dim, FLAGS.mips_k
+    theta = sphere_sampling(dim, 1, rng=rng)[0]
+    for items in [int(items) for items in FLAGS.mips_items]:
+        catalogue = sphere_sampling(dim, items, rng=rng)
+        start = time.perf_counter()
+        index = IVFIndex(dim, rng=rng)
+        index.add(catalogue)
+        logging.info('catalogue of %d items: index of %d lists built in %.2f s'
+                     % (items, index.lists, time.perf_counter() - start))
+        for probes in [int(probes) for probes in FLAGS.mips_probes]:
+            index.probes = probes
+            policy = LinUCB(0.1, FLAGS.rounds)
+            policy.init_rounds(dim, items)
+            exhaustive = indexed = recall = agree = 0
+            for t in range(1, FLAGS.rounds + 1):
+                start = time.perf_counter()
+                item = policy.choose(t, catalogue)
+                exhaustive += time.perf_counter() - start
+                start = time.perf_counter()
+                agree += policy.choose_index(t, index, k) == item
+                indexed += time.perf_counter() - start
+                state = policy.get_state()
+                query = np.linalg.solve(state['A'], state['b'])
+                recall += len(np.intersect1d(index.search(query, k), index.exact(query, k))) / k
+                policy.update_context(catalogue[item] @ theta + rng.normal(), catalogue[item])
+            logging.info('items=%d probes=%d: exhaustive %.2f ms, indexed %.2f ms per decision, recall@%d %.3f, '
+                         'same decision %.3f' % (items, probes, exhaustive / FLAGS.rounds * 1e3,
+                                                 indexed / FLAGS.rounds * 1e3, k, recall / FLAGS.rounds,
+                                                 agree / FLAGS.rounds))
+
+
+def run_learner(policy, T, reward_fn):
+    # play the policy for T steps, reward_fn(t, action) being a cheap lookup so
+    # that the time is spent in the policy
+    for t in range(1, T + 1):
+        action = policy.choice(t)
+        policy.update(reward_fn(t, action), action)
+
+
+def learner_case(make, init, T, reward_fn):
+    # set up a fresh learner and return the callable to be timed
+    policy = make()
+    init(policy)
+    return functools.partial(run_learner, policy, T, reward_fn)
+
+
+def bandit_case(make, pull, T):
+    bandit = make()
+    bandit.init()
+    return functools.partial(pull, bandit, T)
+
+
+def pull_one_by_one(bandit, T, indices):
+    for index in indices[:T]:
+        bandit.pull_arm(index)
+
+
+def suite_cases():
+    """
+    list the cases of the suite as (name, operations, setup), setup() building
+    the learner or bandit and returning the callable performing operations
+    """
+    cases = []
+    for T in [int(T) for T in FLAGS.horizons]:
+        uniform = np.random.random(T + 1).tolist()
+        mus = [0, 0.4, 0.6]
+        ber_reward = lambda t, action, uniform=uniform: 1 if uniform[t] < mus[action] else 0
+        for name, make, init in [('Greedy', Greedy, Greedy.init),
+                                 ('EpsGreedy', lambda: EpsGreedy(1), EpsGreedy.init),
+                                 ('ExploreThenCommit', lambda: ExploreThenCommit(1), lambda p, T=T: p.init(T)),
+                                 ('BerUCB', lambda: BerUCB(0.5), BerUCB.init),
+                                 ('TS', TS, TS.init)]:
+            cases.append(('learner/%s/T=%d' % (name, T), T, functools.partial(learner_case, make, init, T, ber_reward)))
+
+        noise = np.random.normal(size=T + 1).tolist()
+        for arm_num in [int(arm_num) for arm_num in FLAGS.suite_arms]:
+            means = np.random.normal(0, 0.3, arm_num).tolist()
+            reward = lambda t, action, means=means, noise=noise: means[action] + noise[t]
+            for heap in [False, True]:
+                name = 'learner/MultiUCB%s/K=%d/T=%d' % ('-heap' if heap else '', arm_num, T)
+                cases.append((name, T, functools.partial(learner_case, lambda heap=heap: MultiUCB(0.5, heap),
+                                                         lambda p, means=means: p.init(means), T, reward)))
+        for dim in [int(dim) for dim in FLAGS.suite_dims]:
+            contexts = sphere_sampling(dim, FLAGS.armnum)
+            means = (contexts @ sphere_sampling(dim, 1)[0]).tolist()
+            reward = lambda t, action, means=means, noise=noise: means[action] + noise[t]
+            name = 'learner/LinUCB/d=%d/K=%d/T=%d' % (dim, FLAGS.armnum, T)
+            cases.append((name, T, functools.partial(learner_case, lambda T=T: LinUCB(0.1, T),
+                                                     lambda p, contexts=contexts: p.init(contexts), T, reward)))
+
+        indices = (np.arange(T) % 2 + 1).tolist()
+        make = lambda: BernoulliBandit(0.4, 0.6, rng=np.random.default_rng(0))
+        cases.append(('bandit/BernoulliBandit/pull_arm/T=%d' % T, T,
+                      functools.partial(bandit_case, make, functools.partial(pull_one_by_one, indices=indices), T)))
+        cases.append(('bandit/BernoulliBandit/pull_many/T=%d' % T, T,
+                      functools.partial(bandit_case, make, lambda b, T, indices=indices: b.pull_many(indices), T)))
+        for arm_num in [int(arm_num) for arm_num in FLAGS.suite_arms]:
+            indices = np.random.randint(arm_num, size=T).tolist()
+            for bandit_class in [LinearBandit, ArrayLinearBandit]:
+                make = lambda arm_num=arm_num, bandit_class=bandit_class: \
+                    bandit_class(sphere_sampling(3, arm_num), [1, 0, 0], np.random.default_rng(0))
+                name = bandit_class.__name__
+                one_by_one = functools.partial(pull_one_by_one, indices=indices)
+                many = lambda b, T, indices=indices: b.pull_many(indices)
+                cases.append(('bandit/%s/pull_arm/K=%d/T=%d' % (name, arm_num, T), T,
+                              functools.partial(bandit_case, make, one_by_one, T)))
+                cases.append(('bandit/%s/pull_many/K=%d/T=%d' % (name, arm_num, T), T,
+                              functools.partial(bandit_case, make, many, T)))
+    return cases
+
+
+def measure(operations, setup):
+    """operations per second of the callable built by setup, and peak memory of setup and run in MB"""
+    run = setup()
+    start = time.perf_counter()
+    run()
+    ops_per_sec = operations / (time.perf_counter() - start)
+
+    # memory is traced in a separate run since tracing slows python down
+    tracemalloc.start()
+    setup()()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'ops_per_sec': ops_per_sec, 'peak_mb': peak / 2 ** 20}
+
+
+def compare(results, baseline):
+    """names of the cases slower or larger than the baseline beyond FLAGS.threshold"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        slower = result['ops_per_sec'] < base['ops_per_sec'] * (1 - FLAGS.threshold)
+        # allow a little slack for cases which hardly allocate anything
+        larger = result['peak_mb'] > base['peak_mb'] * (1 + FLAGS.threshold) + 0.1
+        if slower or larger:
+            regressions.append(name)
+    return regressions
+
+
+def bench_suite():
+    # measure every learner and bandit, then compare with the baseline
+    results = dict()
+    for name, operations, setup in suite_cases():
+        np.random.seed(0)
+        results[name] = measure(operations, setup)
+
+    baseline = None
+    if os.path.exists(FLAGS.baseline) and not FLAGS.update_baseline:
+        with open(FLAGS.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+
+    logging.info('%-48s %14s %10s %14s' % ('case', 'ops/sec', 'peak MB', 'vs baseline'))
+    for name, result in results.items():
+        change = ''
+        if baseline and name in baseline:
+            change = '%+.1f%%' % (100 * (result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1))
+        logging.info('%-48s %14.0f %10.2f %14s' % (name, result['ops_per_sec'], result['peak_mb'], change))
+
+    report = {'machine': platform.platform(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+    if FLAGS.results:
+        with open(FLAGS.results, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline is None:
+        with open(FLAGS.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info('baseline written to %s' % FLAGS.baseline)
+        return 0
+
+    regressions = compare(results, baseline)
+    for name in regressions:
+        logging.warning('regression in %s: %.0f ops/sec and %.2f MB (baseline %.0f ops/sec and %.2f MB)'
+                        % (name, results[name]['ops_per_sec'], results[name]['peak_mb'],
+                           baseline[name]['ops_per_sec'], baseline[name]['peak_mb']))
+    return 1 if regressions else 0
+
+
+def bench_feedback():
+    # decisions per second and regret of the learners when the rewards are
+    # delivered in bulk, on the same reward tapes for every setting
+    T = int(FLAGS.horizons[-1])
+    contexts = sphere_sampling(3, FLAGS.armnum)
+    for name, make, init, bandit_fn in [
+            ('TS', TS, TS.init, lambda: BernoulliBandit(0.4, 0.6, rng=np.random.default_rng(0))),
+            ('UCB', lambda: BerUCB(0.5), BerUCB.init, lambda: BernoulliBandit(0.4, 0.6, rng=np.random.default_rng(0))),
+            ('MultiUCB', lambda: MultiUCB(0.5), lambda p: p.init(contexts),
+             lambda: LinearBandit(contexts, [1, 0, 0], np.random.default_rng(0))),
+            ('LinUCB', lambda: LinUCB(0.1, T), lambda p: p.init(contexts),
+             lambda: LinearBandit(contexts, [1, 0, 0], np.random.default_rng(0)))]:
+        for every in [int(every) for every in FLAGS.feedback_every]:
+            np.random.seed(0)
+            policy, bandit = make(), bandit_fn()
+            init(policy)
+            bandit.init()
+            start = time.perf_counter()
+            regrets = play(policy, bandit, T, [0, T], every)
+            elapsed = time.perf_counter() - start
+            logging.info('%s feedback every %d steps: %.0f decisions/sec, regret %.1f'
+                         % (name, every, T / elapsed, regrets[T]))
+
+
+def time_snapshot(name, learner, make):
+    # size, save time and load time, read and memory-mapped, of a snapshot
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'learner.snap')
+        start = time.perf_counter()
+        save_snapshot(learner, path)
+        save = time.perf_counter() - start
+        loads = []
+        for mmap in [False, True]:
+            start = time.perf_counter()
+            load_snapshot(make(), path, mmap)
+            loads.append(time.perf_counter() - start)
+        logging.info('%s: %.2f MB, save %.2f ms, load %.2f ms, mmap load %.2f ms'
+                     % (name, os.path.getsize(path) / 2 ** 20, save * 1e3, loads[0] * 1e3, loads[1] * 1e3))
+
+
+def bench_snapshot():
+    # snapshots of MultiUCB as the number of arms grows and of LinUCB as the
+    # dimension grows, after one update of every arm
+    for arm_num in [int(arm_num) for arm_num in FLAGS.snapshot_arms]:
+        policy = MultiUCB(0.5)
+        policy.init(range(arm_num))
+        policy.update_batch(np.arange(arm_num), np.random.normal(size=arm_num))
+        time_snapshot('MultiUCB arms=%d' % arm_num, policy, lambda: MultiUCB(0.5))
+    dtype = np.float32 if FLAGS.float32 else np.float64
+    for dim in [int(dim) for dim in FLAGS.dims]:
+        policy = LinUCB(0.1, FLAGS.rounds, dtype)
+        policy.init(sphere_sampling(dim, FLAGS.armnum, dtype))
+        policy.update_batch(np.arange(FLAGS.armnum), np.random.normal(size=FLAGS.armnum))
+        time_snapshot('LinUCB dim=%d arms=%d' % (dim, FLAGS.armnum), policy,
+                      lambda: LinUCB(0.1, FLAGS.rounds, dtype))
+
+
+# modules of the simulation core, and the plotting stack they must not pull in
+CORE_MODULES = ['learner', 'bandit', 'batch', 'results', 'runner', 'experiment', 'profiler', 'snapshot']
+PLOTTING_MODULES = ['matplotlib', 'pandas', 'seaborn']
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import %s
+print(time.perf_counter() - start)
+print(','.join(m for m in %r if m in sys.modules))
+"""
+
+
+def bench_import_time():
+    # import the simulation core in fresh interpreters, as pool workers do,
+    # and check it against the budget without loading the plotting stack
+    script = IMPORT_SCRIPT % (', '.join(CORE_MODULES), PLOTTING_MODULES)
+    times = []
+    for _ in range(FLAGS.import_runs):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split('\n')
+        times.append(float(output[0]))
+        loaded = output[1]
+    logging.info('import of %s: %.3f s (best of %d), budget %.3f s'
+                 % (', '.join(CORE_MODULES), min(times), FLAGS.import_runs, FLAGS.import_budget))
+
+    failed = False
+    if loaded:
+        logging.warning('the simulation core imports the plotting modules %s' % loaded)
+        failed = True
+    if min(times) > FLAGS.import_budget:
+        logging.warning('the import of the simulation core exceeds its budget')
+        failed = True
+    return 1 if failed else 0
+
+
+BENCHMARKS = {
+    'suite': bench_suite,
+    'linucb_dim': bench_linucb_dim,
+    'multiucb_arms': bench_multiucb_arms,
+    'bernoulli_arms': bench_bernoulli_arms,
+    'mips': bench_mips,
+    'import_time': bench_import_time,
+    'feedback': bench_feedback,
+    'snapshot': bench_snapshot,
+}
+
+
+def main(argv):
+    del argv
+
+    if FLAGS.bench not in BENCHMARKS:
+        logging.fatal('Unknown benchmark %s, choose from %s' % (FLAGS.bench, ', '.join(BENCHMARKS)))
+    np.random.seed(0)
+    return BENCHMARKS[FLAGS.bench]()
+
+
+if __name__ == '__main__':
+    app.run(main)
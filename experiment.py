@@ -0,0 +1,401 @@
+import csv
+import json
+import os
+import sys
+import time
+from statistics import NormalDist
+from absl import flags
+from absl import logging
+import numpy as np
+import manifest
+from profiler import Profiler
+from results import RegretAggregator, TraceStore, remove_results, pseudo_regrets, pull_fractions
+from runner import run_trials
+from utils import open_store, write_to_file, write_trials
+
+FLAGS = flags.FLAGS
+
+# profiler of the run with --profile, created on first use
+_profile = None
+
+# columns of the tidy table of a hyper-parameter sweep, one row per
+# (configuration, environment, horizon)
+SWEEP_COLUMNS = ['policy', 'parameter', 'value', 'env', 'horizon', 'mean', 'std', 'trials']
+
+# flags of one process of a sharded run, the others are taken from the manifest
+LOCAL_FLAGS = ['shard', 'manifest', 'shard_trials', 'reclaim_after', 'workers', 'out', 'fig', 'format',
+               'export_json', 'novar', 'rm', 'resume', 'checkpoint_every', 'paired', 'profile', 'profile_sample',
+               'profile_out', 'sweep_out']
+
+# store of the actions of every trial with --trace, opened on first use
+_traces = None
+
+
+def checkpoints(T):
+    """
+    the horizons at which regrets are reported, from 0 to at most T: every
+    FLAGS.freq steps, FLAGS.log_points log-spaced horizons, or the explicit
+    FLAGS.checkpoints
+    """
+    if FLAGS.schedule == 'log':
+        horizons = np.unique(np.round(np.logspace(0, np.log10(max(T, 1)), FLAGS.log_points)).astype(int))
+    elif FLAGS.schedule == 'explicit':
+        if not FLAGS.checkpoints:
+            logging.fatal('--schedule=explicit needs --checkpoints!')
+        horizons = sorted({int(horizon) for horizon in FLAGS.checkpoints if 0 < int(horizon) <= T})
+    else:
+        return list(range(0, T + 1, FLAGS.freq))
+    return [0] + [int(horizon) for horizon in horizons]
+
+
+def shard_setup():
+    """
+    With --shard=work or --shard=merge take the flags of the experiment from
+    the manifest in FLAGS.manifest, so that every process runs exactly the
+    planned experiment whatever its own command line
+    """
+    if 'shard' not in FLAGS or FLAGS.shard in [None, 'plan']:
+        return
+    planned = manifest.load(FLAGS.manifest)
+    if planned['program'] != os.path.basename(sys.argv[0]):
+        logging.fatal('%s holds a manifest of %s!' % (FLAGS.manifest, planned['program']))
+    for name, value in planned['flags'].items():
+        if FLAGS[name].present and FLAGS[name].value != value:
+            logging.warning('--%s is taken from the manifest: %s' % (name, value))
+        FLAGS[name].value = value
+
+
+def run_sharded(groups, crn):
+    """
+    Run the (policy, trial) units of groups, a list of (trial_fn, policies),
+    in shards. --shard=plan writes the manifest of the shards into
+    FLAGS.manifest, and --shard=work claims and runs shards until none is
+    left; both return None. --shard=merge returns the (group, policy, trial,
+    result) tuples of all units in the order of a single-process run.
+    """
+    if FLAGS.shard == 'plan':
+        flag_values = {flag.name: flag.value for flag in FLAGS.get_key_flags_for_module(sys.argv[0])
+                       if flag.name not in LOCAL_FLAGS}
+        planned = manifest.plan(FLAGS.manifest, os.path.basename(sys.argv[0]), flag_values,
+                                [len(policies) for _, policies in groups], FLAGS.trials, FLAGS.shard_trials)
+        logging.info('planned %d shards in %s' % (len(planned['shards']), FLAGS.manifest))
+        return None
+
+    if FLAGS.shard == 'work':
+        planned = manifest.load(FLAGS.manifest)
+        count = 0
+        for i, shard in enumerate(planned['shards']):
+            if manifest.done(FLAGS.manifest, i) or not manifest.claim(FLAGS.manifest, i, FLAGS.reclaim_after):
+                continue
+            trial_fn, policies = groups[shard['group']]
+            target, (start, stop) = policies[shard['policy']], shard['trials']
+            logging.info('run shard %d: %s, trials %d to %d' % (i, target.name, start, stop - 1))
+            units = run_trials(trial_fn, policies, FLAGS.trials, FLAGS.seed, FLAGS.workers, crn,
+                               skip=lambda policy, trial: policy is not target or not start <= trial < stop,
+                               totals=profile_totals())
+            manifest.save(FLAGS.manifest, i, [(trial, result) for _, trial, result in units])
+            count += 1
+        logging.info('ran %d shards, no shard of %s is left' % (count, FLAGS.manifest))
+        return None
+
+    try:
+        results = manifest.merge(FLAGS.manifest)
+    except Exception as e:
+        logging.fatal(str(e))
+    return ((group, policy, trial, results[(group, i, trial)])
+            for group, (_, policies) in enumerate(groups) for i, policy in enumerate(policies)
+            for trial in range(FLAGS.trials))
+
+
+def checkpoint_path():
+    # the checkpoint of the regret aggregator lives next to FLAGS.out
+    return FLAGS.out.rstrip('/') + '.ckpt'
+
+
+def prepare_output():
+    """
+    Remove, resume or protect the previously generated data in FLAGS.out and
+    return the regret aggregator of the run. On resume the output is cut back
+    to the trials recorded in the last checkpoint.
+    """
+    if FLAGS.rm:
+        remove_results(FLAGS.out)
+        remove_results(checkpoint_path())
+        if 'trace' in FLAGS and FLAGS.trace:
+            remove_results(FLAGS.trace)
+    elif FLAGS.resume and not os.path.exists(checkpoint_path()) and os.path.exists(FLAGS.out):
+        # the data may come from another run, so it is never removed silently
+        logging.fatal(('%s has no checkpoint %s to resume from. Make sure you'
+                       ' have archived previously generated data and try --rm'
+                       ' flag which will automatically delete it.') % (FLAGS.out, checkpoint_path()))
+    elif FLAGS.resume and os.path.exists(checkpoint_path()):
+        aggregator = RegretAggregator.load(checkpoint_path())
+        if FLAGS.format == 'npy':
+            open_store(FLAGS.out).truncate({learner: aggregator.trials(learner) for learner in aggregator.learners})
+        elif os.path.exists(FLAGS.out):
+            with open(FLAGS.out, 'r+') as f:
+                f.truncate(aggregator.extra.get('size', 0))
+        logging.info('resume from %s with %d completed trials'
+                     % (checkpoint_path(), sum(aggregator.trials(learner) for learner in aggregator.learners)))
+        return aggregator
+    elif os.path.exists(FLAGS.out):
+        logging.fatal(('%s is not empty. Make sure you have'
+                       ' archived previously generated data. '
+                       'Try --rm flag which will automatically'
+                       ' delete previous data, or --resume to'
+                       ' continue an interrupted run.') % FLAGS.out)
+    return RegretAggregator()
+
+
+def profile_totals():
+    """the profiler collecting the phases of all units, None without --profile"""
+    global _profile
+    if 'profile' in FLAGS and FLAGS.profile and _profile is None:
+        _profile = Profiler(FLAGS.profile_sample)
+    return _profile
+
+
+def save_checkpoint(aggregator):
+    # record the aggregated statistics together with the size of the output
+    totals = profile_totals()
+    if totals is not None:
+        start = time.perf_counter()
+    if FLAGS.format == 'json' and os.path.exists(FLAGS.out):
+        aggregator.extra['size'] = os.path.getsize(FLAGS.out)
+    aggregator.save(checkpoint_path())
+    if totals is not None:
+        totals.add('checkpoint', time.perf_counter() - start)
+
+
+def record(aggregator, learner, trials, horizons, regrets):
+    """write and aggregate the results of many trials of a learner at once"""
+    totals = profile_totals()
+    if totals is not None:
+        totals.policy = learner
+        start = time.perf_counter()
+    write_trials(learner, horizons, regrets)
+    aggregator.add_many(learner, trials, horizons, regrets)
+    if totals is not None:
+        totals.add('write', time.perf_counter() - start, len(trials))
+    save_checkpoint(aggregator)
+
+
+def trace_store():
+    """the store of the actions of every trial with --trace, None otherwise"""
+    global _traces
+    if 'trace' in FLAGS and FLAGS.trace and _traces is None:
+        _traces = TraceStore(FLAGS.trace)
+    return _traces
+
+
+def record_units(units, aggregator):
+    # write and aggregate the (policy, trial, result) tuples of run_trials, and
+    # checkpoint the aggregator every FLAGS.checkpoint_every trials. With
+    # --trace a result also holds the actions and the means of the arms.
+    totals = profile_totals()
+    current = None
+    for count, (policy, trial, minimax_regret) in enumerate(units, 1):
+        if isinstance(minimax_regret, tuple):
+            minimax_regret, actions, means = minimax_regret
+            trace_store().write(policy.name, trial, actions, means)
+        if policy is not current:
+            logging.info('run policy %s' % policy.name)
+            current = policy
+        if trial % 50 == 0:
+            logging.info('trial: %d' % trial)
+
+        # output one trial result into the output file
+        if totals is not None:
+            totals.policy = policy.name
+            start = time.perf_counter()
+        write_to_file(dict({policy.name: minimax_regret}))
+        aggregator.add(policy.name, trial, minimax_regret)
+        if totals is not None:
+            totals.add('write', time.perf_counter() - start)
+        if count % FLAGS.checkpoint_every == 0:
+            save_checkpoint(aggregator)
+    save_checkpoint(aggregator)
+
+
+def run_and_record(trial_fn, policies, aggregator):
+    """
+    Run every (policy, trial) unit not completed yet, write its result into
+    FLAGS.out, add it to the aggregator and checkpoint the aggregator every
+    FLAGS.checkpoint_every trials
+    """
+    units = run_trials(trial_fn, policies, FLAGS.trials, FLAGS.seed, FLAGS.workers, FLAGS.crn,
+                       skip=lambda policy, trial: aggregator.done(policy.name, trial), totals=profile_totals())
+    record_units(units, aggregator)
+
+
+def play(policy, bandit, T, horizons, feedback_every=1, trace=None):
+    """
+    Play an initialized policy on an initialized bandit for T steps and return
+    the regrets at every one of the sorted horizons. With
+    feedback_every > 1 rewards are delivered in bulk every feedback_every
+    steps: the decisions of a block are made by one choose_batch() and its
+    rewards applied by one update_batch(). The actions are appended to the
+    list trace if given.
+    """
+    regrets = {0: bandit.regret(0)}
+    rewards = 0
+    if feedback_every <= 1:
+        # play the steps between two horizons without checking for them
+        t = 0
+        for j, horizon in enumerate(list(horizons) + [T]):
+            for t in range(t + 1, horizon + 1):
+                action = policy.choice(t)
+                reward = bandit.pull_arm(action)
+                policy.update(reward, action)
+                rewards += reward
+                if trace is not None:
+                    trace.append(action)
+            t = horizon
+            if horizon and j < len(horizons):
+                regrets[horizon] = bandit.regret(rewards)
+        return regrets
+
+    reported = set(horizons)
+    for start in range(1, T + 1, feedback_every):
+        actions = policy.choose_batch(start, min(feedback_every, T + 1 - start))
+        block = []
+        for t, action in enumerate(actions, start):
+            reward = bandit.pull_arm(action)
+            block.append(reward)
+            rewards += reward
+            if t in reported:
+                regrets[t] = bandit.regret(rewards)
+        policy.update_batch(actions, block)
+        if trace is not None:
+            trace.extend(actions)
+    return regrets
+
+
+def sweep_rows(policy, parameter, value, envs, regrets, horizons):
+    """
+    rows of the tidy sweep table for one configuration of a policy, where
+    regrets has shape (len(envs), trials, len(horizons)). The minimax rows
+    take the worst environment of every trial, as --minimax does.
+    """
+    rows = []
+    worst = regrets.max(axis=0)
+    for env, env_regrets in list(zip(envs, regrets)) + [('minimax', worst)]:
+        trials = len(env_regrets)
+        mean = env_regrets.mean(axis=0)
+        std = env_regrets.std(axis=0, ddof=1) if trials > 1 else np.zeros(len(horizons))
+        for horizon, m, s in zip(horizons, mean, std):
+            rows.append({'policy': policy, 'parameter': parameter or '', 'value': '' if value is None else value,
+                         'env': env, 'horizon': int(horizon), 'mean': float(m), 'std': float(s), 'trials': trials})
+    return rows
+
+
+def write_sweep(rows):
+    """write the tidy sweep table into FLAGS.sweep_out and report the best configuration of every policy"""
+    with open(FLAGS.sweep_out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SWEEP_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    # best configuration by the minimax regret at the last horizon
+    last = max(row['horizon'] for row in rows)
+    best = dict()
+    for row in rows:
+        if row['env'] == 'minimax' and row['horizon'] == last:
+            if row['policy'] not in best or row['mean'] < best[row['policy']]['mean']:
+                best[row['policy']] = row
+    for policy, row in best.items():
+        config = ' (%s %s)' % (row['parameter'], row['value']) if row['parameter'] else ''
+        logging.info('%s%s: minimax regret at horizon %d: mean %.3f, std %.3f'
+                     % (policy, config, last, row['mean'], row['std']))
+    logging.info('wrote %d rows of the sweep into %s' % (len(rows), FLAGS.sweep_out))
+
+
+def ci_half_width(aggregator, learner):
+    """half width of the confidence interval of the mean regret, at the last horizon or the widest of all"""
+    summary = aggregator.summary(learner)
+    z = NormalDist().inv_cdf((1 + FLAGS.conf) / 2)
+    widths = z * summary['std'] / np.sqrt(summary['count'])
+    return widths.max() if FLAGS.tol_all else widths[-1]
+
+
+def run_adaptive(trial_fn, policies, aggregator):
+    """
+    Run trials of every policy until the confidence interval of its regret is
+    narrower than FLAGS.tol, or FLAGS.max_trials trials or FLAGS.time_budget
+    seconds are spent on it, and report the number of trials every policy
+    needed. Trials run in rounds of 4 * FLAGS.workers and keep the seeds they
+    would have in a run with a fixed number of trials.
+    """
+    round_size = 4 * FLAGS.workers if FLAGS.workers > 1 else 1
+    for policy in policies:
+        start = time.time()
+        while True:
+            count = aggregator.trials(policy.name)
+            if count >= FLAGS.min_trials:
+                width = ci_half_width(aggregator, policy.name)
+                if width <= FLAGS.tol:
+                    reason = 'confidence interval +-%.3f' % width
+                    break
+            if count >= FLAGS.max_trials:
+                reason = 'max trials'
+                break
+            if FLAGS.time_budget and time.time() - start >= FLAGS.time_budget:
+                reason = 'time budget'
+                break
+
+            upper = min(count + round_size, FLAGS.max_trials)
+            units = run_trials(trial_fn, policies, upper, FLAGS.seed, FLAGS.workers, FLAGS.crn,
+                               skip=lambda other, trial: other is not policy or aggregator.done(other.name, trial),
+                               totals=profile_totals())
+            record_units(units, aggregator)
+
+        aggregator.extra.setdefault('trials_needed', dict())[policy.name] = count
+        save_checkpoint(aggregator)
+        logging.info('%s stopped after %d trials (%s)' % (policy.name, count, reason))
+
+
+def log_summary(aggregator, quantity='regret'):
+    # report the streaming statistics of the regret (or the recorded quantity)
+    # at the last horizon
+    for learner in aggregator.learners:
+        summary = aggregator.summary(learner)
+        logging.info('%s: %d trials, %s at horizon %d: mean %.3f, std %.3f, min %.3f, max %.3f'
+                     % (learner, summary['count'], quantity, aggregator.horizons[-1], summary['mean'][-1],
+                        summary['std'][-1], summary['min'][-1], summary['max'][-1]))
+
+
+def log_traces():
+    """report the pseudo-regrets and the pulls of the best arm computed afterwards from the traces of --trace"""
+    traces = trace_store()
+    if traces is None:
+        return
+    for learner in traces.learners:
+        actions, means = traces.actions(learner), traces.means(learner)
+        T = actions.shape[-1]
+        horizons = checkpoints(T)
+        # minimax over the environments of every trial, as for the regrets
+        regrets = pseudo_regrets(actions, means, horizons).max(axis=1)
+        fractions = pull_fractions(actions, means.shape[-1], [T])[..., 0, :]
+        best = np.take_along_axis(fractions, means.argmax(axis=-1)[..., None], axis=-1)
+        logging.info('%s: %d traced trials, pseudo-regret at horizon %d: mean %.3f, std %.3f, pulls of the best '
+                     'arm %.3f' % (learner, len(actions), T, regrets[:, -1].mean(), regrets[:, -1].std(),
+                                   best.mean()))
+
+
+def log_profile():
+    """report the time spent in every phase with --profile and dump it to FLAGS.profile_out"""
+    totals = profile_totals()
+    if totals is None:
+        return
+    for policy in totals.policies:
+        logging.info('profile of %s' % policy)
+        logging.info('%-12s %10s %10s %12s %8s' % ('phase', 'calls', 'seconds', 'us/call', 'share'))
+        for phase, calls, seconds, per_call, share in totals.table(policy):
+            logging.info('%-12s %10d %10.3f %12.2f %7.1f%%' % (phase, calls, seconds, per_call, 100 * share))
+        histogram = totals.histogram(policy)
+        if histogram:
+            logging.info('sampled decision latencies: %s'
+                         % ', '.join('<%dus: %d' % (bound, count) for bound, count in histogram))
+    if FLAGS.profile_out:
+        with open(FLAGS.profile_out, 'w') as f:
+            json.dump(totals.state(), f, indent=2)
@@ -1,117 +1,253 @@
-
-import os
+import functools
 from absl import app
 from absl import logging
 from absl import flags
 from learner import *
 from bandit import BernoulliBandit
-from utils import draw, write_to_file
+from batch import BatchBernoulliBandit, BatchGreedy, BatchEpsGreedy, BatchExploreThenCommit, \
+    BatchBerUCB, BatchTS, simulate
+from experiment import prepare_output, run_adaptive, record, run_and_record, record_units, log_summary, \
+    log_profile, log_traces, play, checkpoints, sweep_rows, write_sweep, shard_setup, run_sharded
+from profiler import instrument
+from results import action_dtype
+from utils import draw, open_store
+import numpy as np
 
 FLAGS = flags.FLAGS
 
 # Flags for general settings
 flags.DEFINE_string('out', 'data.out', 'file for generated data')
 flags.DEFINE_string('fig', 'figure.png', 'file for generated figure')
+flags.DEFINE_enum('format', 'json', ['json', 'npy'], 'json lines file or a directory of columnar npy arrays')
+flags.DEFINE_string('export_json', None, 'also export the npy results to this json lines file')
 flags.DEFINE_boolean('novar', True, 'do not show std in the output figure')
 flags.DEFINE_boolean('rm', False, 'remove previously generated data')
+flags.DEFINE_boolean('resume', False, 'resume an interrupted run from its checkpoint')
+flags.DEFINE_integer('checkpoint_every', 10, 'number of trials between two checkpoints')
 flags.DEFINE_boolean('minimax', False, 'compute minimax regret based on given arms')
 flags.DEFINE_float('prob', 0.2, 'the true probability of the first arm')
+flags.DEFINE_list('mus', None, 'true probabilities of all arms of a K-armed bandit, overriding --prob and --minimax')
 flags.DEFINE_integer('T', 1000, 'time horizon')
 flags.DEFINE_integer('trials', 100, 'total number of trials')
 flags.DEFINE_integer('freq', 50, 'frenquency to report the intermediate regrets')
+flags.DEFINE_enum('schedule', 'uniform', ['uniform', 'log', 'explicit'],
+                  'report the regrets every --freq steps, at --log_points log-spaced horizons or at --checkpoints')
+flags.DEFINE_integer('log_points', 20, 'number of log-spaced horizons with --schedule=log')
+flags.DEFINE_list('checkpoints', None, 'horizons to report the regrets at with --schedule=explicit')
+flags.DEFINE_string('trace', None, 'directory to record the actions of every trial into, for pseudo-regrets')
+flags.DEFINE_float('tol', None, 'run trials until the confidence interval of the regret is this narrow')
+flags.DEFINE_boolean('tol_all', False, 'require the tolerance at every reported horizon, not only the last')
+flags.DEFINE_float('conf', 0.95, 'confidence level of the interval for --tol')
+flags.DEFINE_integer('min_trials', 10, 'minimal number of trials per policy with --tol', lower_bound=2)
+flags.DEFINE_integer('max_trials', 10000, 'maximal number of trials per policy with --tol')
+flags.DEFINE_float('time_budget', None, 'maximal seconds spent on one policy with --tol')
+flags.DEFINE_integer('seed', 200, 'master seed from which the seed of every trial is derived')
+flags.DEFINE_integer('workers', 1, 'number of processes to run the trials')
+flags.DEFINE_enum('shard', None, ['plan', 'work', 'merge'],
+                  'plan the shards of the run into --manifest, run shards claimed from it, or merge their results')
+flags.DEFINE_string('manifest', 'manifest', 'directory shared by all processes of a sharded run')
+flags.DEFINE_integer('shard_trials', 10, 'number of trials of one policy in a shard')
+flags.DEFINE_float('reclaim_after', None, 'take over shards claimed this many seconds ago and still not finished')
+flags.DEFINE_boolean('crn', False, 'replay the same reward tapes to every policy in a trial')
+flags.DEFINE_string('paired', None, 'draw paired regret differences to this learner (use with --crn)')
+flags.DEFINE_integer('block', 1024, 'number of rewards drawn at a time for every arm')
+flags.DEFINE_boolean('vectorized', False, 'run all trials of a policy at once with numpy arrays')
+flags.DEFINE_integer('feedback_every', 1, 'deliver the rewards in bulk every this many steps')
+flags.DEFINE_boolean('profile', False, 'time choice, pull, update, regret and writing of every policy')
+flags.DEFINE_integer('profile_sample', 0, 'with --profile, put every n-th decision latency into a histogram')
+flags.DEFINE_string('profile_out', None, 'with --profile, dump the profile to this json file')
+flags.DEFINE_boolean('sweep', False, 'run every configuration of the grids side by side and write a tidy table')
+flags.DEFINE_string('sweep_out', 'sweep.csv', 'csv file for the table of the sweep')
+flags.DEFINE_list('prob_grid', None,
+                  'true probabilities of the first arm to sweep over, by default --prob or --minimax')
 
 # Flags for hyper-parameters
 flags.DEFINE_float('eps', 1, 'parameter epsilon for epsilon greedy algorithm')
 flags.DEFINE_float('C', 1, 'parameter C for explore-then-commit algorithm')
+flags.DEFINE_boolean('etc_expected', False, 'use expected rather than realized rewards in the commit phase of ETC')
 flags.DEFINE_float('alpha', 0.5, 'parameter alpha for UCB algorithm')
+flags.DEFINE_list('eps_grid', None, 'values of eps to sweep over, by default --eps')
+flags.DEFINE_list('C_grid', None, 'values of C to sweep over, by default --C')
+flags.DEFINE_list('alpha_grid', None, 'values of alpha to sweep over, by default --alpha')
+
+
+def play_etc(policy, bandit, horizons, feedback_every):
+    # ExploreThenCommit tuned for every horizon separately, all runs replaying
+    # the same reward tapes, for delayed feedback which regrets() cannot model
+    regrets = dict()
+    for horizon in horizons:
+        bandit.rewind()
+        bandit.init()
+        policy.init(horizon)
+        regrets[horizon] = play(policy, bandit, horizon, [0, horizon], feedback_every)[horizon]
+    return regrets
+
+
+def run_trial(policy, rng, mus, T, horizons, block, etc_expected, feedback_every, trace=False):
+    # run one trial of the policy on every tuple of mus and return the minimax
+    # regrets of all reported horizons, the rewards being drawn from rng. With
+    # trace, also return the 0-based actions and the means of every tuple.
+    minimax_regret = dict()
+    actions = []
+
+    for arm_mus in mus:
+        bernoulli_bandit = instrument(BernoulliBandit(*arm_mus, rng=rng, block=block))
+
+        # The reason to exclude ExploreThenCommit is that it's not progressive.
+        # Progressive means process of small T is nested in the process of large T.
+        # All horizons are evaluated at once on shared reward tapes instead,
+        # or one by one on the same tapes when delayed feedback changes the
+        # commit. The actions traced are those of one more run tuned for T.
+        if policy.name == 'ExploreThenCommit':
+            if feedback_every <= 1:
+                regrets = policy.regrets(bernoulli_bandit, horizons, etc_expected)
+                agg_regret = dict(zip(horizons, regrets.tolist()))
+            else:
+                agg_regret = play_etc(policy, bernoulli_bandit, horizons, feedback_every)
+            if trace:
+                bernoulli_bandit.rewind()
+                bernoulli_bandit.init()
+                policy.init(T)
+                actions.append([])
+                play(policy, bernoulli_bandit, T, [0, T], feedback_every, actions[-1])
+        else:
+            # initialization
+            bernoulli_bandit.init()
+            policy.init()
+            actions.append([] if trace else None)
+            agg_regret = play(policy, bernoulli_bandit, T, horizons, feedback_every, actions[-1])
+
+        for t in agg_regret:
+            minimax_regret[t] = max(minimax_regret.get(t, 0), agg_regret[t])
+
+    if trace:
+        # arms of the Bernoulli learners are numbered from 1
+        return minimax_regret, np.array(actions, dtype=action_dtype(len(mus[0]))) - 1, np.array(mus, dtype=float)
+    return minimax_regret
+
+
+def run_vectorized(mus, trials, T, horizons, aggregator):
+    # Every trial is a row of the state arrays, so each time step advances all
+    # trials of a policy together. Every policy has its own generator, so
+    # that skipping the finished policies on resume does not shift the others
+    policies = [BatchGreedy(), BatchEpsGreedy(FLAGS.eps), BatchExploreThenCommit(FLAGS.C),
+                BatchBerUCB(FLAGS.alpha), BatchTS()]
+
+    for i, policy in enumerate(policies):
+        rng = np.random.default_rng(np.random.SeedSequence(FLAGS.seed, spawn_key=(i,)))
+        todo = [trial for trial in range(trials) if not aggregator.done(policy.name, trial)]
+        if not todo:
+            continue
+        logging.info('run policy %s' % policy.name)
+        minimax_regret = 0
+        for arm_mus in mus:
+            bandit = BatchBernoulliBandit(arm_mus, trials, rng)
+            _, regrets = simulate(policy, bandit, T, horizons)
+            minimax_regret = np.maximum(minimax_regret, regrets)
+
+        # output results of all trials into the output file
+        record(aggregator, policy.name, todo, horizons, minimax_regret[todo])
+
+
+def run_sweep(mus, trials, T, horizons):
+    # Every (configuration, environment, trial) is a row of the state arrays,
+    # so one pass per policy runs its whole grid. All rows of a trial share
+    # the same reward stream, whatever their configuration.
+    rng = np.random.default_rng(FLAGS.seed)
+    grids = [(BatchGreedy, None, [None]),
+             (BatchEpsGreedy, 'eps', [float(value) for value in FLAGS.eps_grid or [FLAGS.eps]]),
+             (BatchExploreThenCommit, 'C', [float(value) for value in FLAGS.C_grid or [FLAGS.C]]),
+             (BatchBerUCB, 'alpha', [float(value) for value in FLAGS.alpha_grid or [FLAGS.alpha]]),
+             (BatchTS, None, [None])]
+    envs = ['/'.join('%g' % mu for mu in arm_mus) for arm_mus in mus]
+
+    rows = []
+    for policy_class, parameter, values in grids:
+        # rows are ordered by configuration, then environment, then trial
+        configs = len(values) * len(mus)
+        row_mus = np.repeat(np.tile(np.asarray(mus, dtype=float), (len(values), 1)), trials, axis=0)
+        if parameter is None:
+            policy = policy_class()
+        else:
+            policy = policy_class(np.repeat(values, configs // len(values) * trials))
+        logging.info('run policy %s on %d configurations' % (policy.name, configs))
+        bandit = BatchBernoulliBandit(row_mus, configs * trials, rng, streams=trials)
+        _, regrets = simulate(policy, bandit, T, horizons)
+        regrets = regrets.reshape(len(values), len(mus), trials, len(horizons))
+        for value, config_regrets in zip(values, regrets):
+            rows += sweep_rows(policy.name, parameter, value, envs, config_regrets, horizons)
+    write_sweep(rows)
 
 
 def main(argv):
     del argv
 
-    if FLAGS.rm:
-        os.remove(FLAGS.out)
+    shard_setup()
+    if FLAGS.sweep and (FLAGS.tol or FLAGS.feedback_every > 1):
+        logging.fatal('Adaptive stopping and delayed feedback are not supported with --sweep!')
+    if FLAGS.shard and (FLAGS.tol or FLAGS.vectorized or FLAGS.sweep):
+        logging.fatal('Adaptive stopping, --vectorized and --sweep cannot be sharded!')
+    if FLAGS.trace and (FLAGS.shard or FLAGS.vectorized or FLAGS.sweep):
+        logging.fatal('Actions can only be traced by single-host runs of the unvectorized learners!')
+    if FLAGS.sweep or FLAGS.shard in ['plan', 'work']:
+        aggregator = None
     else:
-        if FLAGS.out in os.listdir('./'):
-            logging.fatal(('%s is not empty. Make sure you have'
-                           ' archived previously generated data. '
-                           'Try --rm flag which will automatically'
-                           ' delete previous data.') % FLAGS.out)
-
-    # # If you want to generate reproducing result, uncomment the line below
-    np.random.seed(200)
+        aggregator = prepare_output()
 
     # Extract all flags of parameters for later use
     trials = FLAGS.trials
-    freq = FLAGS.freq
     T = FLAGS.T
+    horizons = checkpoints(T)
     eps = FLAGS.eps
     C = FLAGS.C
     alpha = FLAGS.alpha
     prob = FLAGS.prob
 
-    # Policies to be compared
-    policies = [Greedy(), EpsGreedy(eps), ExploreThenCommit(C), BerUCB(alpha), TS()]
-    # policies = [UCB(alpha)]
-
     # Get true distribution of Bernoulli arms
     mus = [(prob, 1 - prob)]
     if FLAGS.minimax:
         mus = [(0.4, 0.6), (0.3, 0.7), (0.2, 0.8), (0.25, 0.75), (0.35, 0.65)]
+    if FLAGS.prob_grid:
+        mus = [(float(prob), 1 - float(prob)) for prob in FLAGS.prob_grid]
+    if FLAGS.mus:
+        mus = [tuple(float(mu) for mu in FLAGS.mus)]
+    arm_num = len(mus[0])
 
-    # The main loop
-    for policy in policies:
-        logging.info('run policy %s' % policy.name)
-        for trial in range(trials):
-            if trial % 50 == 0:
-                logging.info('trial: %d' % trial)
-
-            minimax_regret = dict()
-
-            for (mu_1, mu_2) in mus:
-                bernoulli_bandit = BernoulliBandit(mu_1, mu_2)
-                agg_regret = dict()
-
-                # The reason to exclude ExploreThenCommit is that it's not progressive.
-                # Progressive means process of small T is nested in the process of large T
-                if policy.name == 'ExploreThenCommit':
-                    for comp_t in range(0, T + 1):
-                        if comp_t % freq == 0:
-                            if comp_t == 0:
-                                agg_regret[comp_t] = 0
-                            else:
-                                # initialization
-                                bernoulli_bandit.init()
-                                policy.init(comp_t)
-                                rewards = 0
-                                for t in range(1, comp_t + 1):
-                                    action = policy.choice(t)
-                                    reward = bernoulli_bandit.pull_arm(action)
-                                    policy.update(reward, action)
-                                    rewards += reward
-                                agg_regret[comp_t] = bernoulli_bandit.regret(rewards)
-                else:
-                    # initialization
-                    bernoulli_bandit.init()
-                    policy.init()
-                    rewards = 0
-                    for t in range(0, T + 1):
-                        if t > 0:
-                            action = policy.choice(t)
-                            reward = bernoulli_bandit.pull_arm(action)
-                            policy.update(reward, action)
-                            rewards += reward
-                        if t % freq == 0:
-                            agg_regret[t] = bernoulli_bandit.regret(rewards)
-
-                for t in agg_regret:
-                    minimax_regret[t] = max(minimax_regret.get(t, 0), agg_regret[t])
-
-            # output one trial result of into the output file
-            write_to_file(dict({policy.name: minimax_regret}))
-
-    # Generate the final figure
-    draw()
+    # Policies to be compared
+    policies = [Greedy(arm_num), EpsGreedy(eps, arm_num), ExploreThenCommit(C, arm_num), BerUCB(alpha, arm_num),
+                TS(arm_num)]
+    # policies = [UCB(alpha)]
+
+    if FLAGS.sweep:
+        run_sweep(mus, trials, T, horizons)
+        return
+    if FLAGS.vectorized:
+        if FLAGS.tol or FLAGS.feedback_every > 1:
+            logging.fatal('Adaptive stopping and delayed feedback are not supported with --vectorized!')
+        run_vectorized(mus, trials, T, horizons, aggregator)
+    else:
+        # The main loop, (policy, trial) units are run by a pool of FLAGS.workers
+        trial_fn = functools.partial(run_trial, mus=mus, T=T, horizons=horizons, block=FLAGS.block,
+                                     etc_expected=FLAGS.etc_expected, feedback_every=FLAGS.feedback_every,
+                                     trace=bool(FLAGS.trace))
+        if FLAGS.shard:
+            units = run_sharded([(trial_fn, policies)], FLAGS.crn)
+            if units is None:
+                return
+            record_units(((policy, trial, result) for _, policy, trial, result in units), aggregator)
+        elif FLAGS.tol:
+            run_adaptive(trial_fn, policies, aggregator)
+        else:
+            run_and_record(trial_fn, policies, aggregator)
+
+    if FLAGS.export_json and FLAGS.format == 'npy':
+        open_store(FLAGS.out).export_json(FLAGS.export_json)
+
+    # Report the aggregated regrets and generate the final figure
+    log_summary(aggregator)
+    log_traces()
+    log_profile()
+    draw(FLAGS.paired)
 
 
 # The main entry
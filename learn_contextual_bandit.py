@@ -1,11 +1,16 @@
-
-import os
+import functools
 from absl import app
 from absl import logging
 from absl import flags
 from learner import Uniform_Sampling, MultiUCB, LinUCB
-from bandit import LinearBandit
-from utils import draw, write_to_file, sphere_sampling
+from bandit import LinearBandit, ArrayLinearBandit, CatalogueBandit
+from experiment import prepare_output, run_adaptive, run_and_record, record_units, log_summary, log_profile, play, \
+    log_traces, checkpoints, sweep_rows, write_sweep, shard_setup, run_sharded
+from runner import run_trials
+from mips import IVFIndex
+from profiler import instrument
+from results import action_dtype
+from utils import draw, open_store, sphere_sampling
 import numpy as np
 
 FLAGS = flags.FLAGS
@@ -13,76 +18,236 @@ FLAGS = flags.FLAGS
 # flag of general settings
 flags.DEFINE_string('out', 'data.out', 'file for generated data')
 flags.DEFINE_string('fig', 'figure.png', 'file for generated figure')
+flags.DEFINE_enum('format', 'json', ['json', 'npy'], 'json lines file or a directory of columnar npy arrays')
+flags.DEFINE_string('export_json', None, 'also export the npy results to this json lines file')
 flags.DEFINE_boolean('novar', True, 'do not show std in the output figure')
 flags.DEFINE_boolean('rm', False, 'remove previously generated data')
+flags.DEFINE_boolean('resume', False, 'resume an interrupted run from its checkpoint')
+flags.DEFINE_integer('checkpoint_every', 10, 'number of trials between two checkpoints')
 flags.DEFINE_integer('T', 1000, 'time horizon')
 flags.DEFINE_integer('trials', 50, 'total number of trials')
 flags.DEFINE_integer('freq', 50, 'frenquency to report the intermediate regrets')
+flags.DEFINE_enum('schedule', 'uniform', ['uniform', 'log', 'explicit'],
+                  'report the regrets every --freq steps, at --log_points log-spaced horizons or at --checkpoints')
+flags.DEFINE_integer('log_points', 20, 'number of log-spaced horizons with --schedule=log')
+flags.DEFINE_list('checkpoints', None, 'horizons to report the regrets at with --schedule=explicit')
+flags.DEFINE_string('trace', None, 'directory to record the actions of every trial into, for pseudo-regrets')
+flags.DEFINE_float('tol', None, 'run trials until the confidence interval of the regret is this narrow')
+flags.DEFINE_boolean('tol_all', False, 'require the tolerance at every reported horizon, not only the last')
+flags.DEFINE_float('conf', 0.95, 'confidence level of the interval for --tol')
+flags.DEFINE_integer('min_trials', 10, 'minimal number of trials per policy with --tol', lower_bound=2)
+flags.DEFINE_integer('max_trials', 10000, 'maximal number of trials per policy with --tol')
+flags.DEFINE_float('time_budget', None, 'maximal seconds spent on one policy with --tol')
 flags.DEFINE_integer('armnum', 10, 'number of arms for for input')
+flags.DEFINE_boolean('ucb_heap', False, 'select the UCB arm through a heap, faster for very many arms')
+flags.DEFINE_integer('dim', 3, 'dimension of the contexts and theta')
+flags.DEFINE_boolean('float32', False, 'use single precision contexts and LinUCB statistics')
 flags.DEFINE_boolean('minimax', True, 'compute minimax regret')
 flags.DEFINE_integer('inputnum', 10, 'number of inputs used in computing minimax regret')
+flags.DEFINE_integer('seed', 100, 'master seed from which the seed of every trial is derived')
+flags.DEFINE_integer('workers', 1, 'number of processes to run the trials')
+flags.DEFINE_enum('shard', None, ['plan', 'work', 'merge'],
+                  'plan the shards of the run into --manifest, run shards claimed from it, or merge their results')
+flags.DEFINE_string('manifest', 'manifest', 'directory shared by all processes of a sharded run')
+flags.DEFINE_integer('shard_trials', 10, 'number of trials of one policy in a shard')
+flags.DEFINE_float('reclaim_after', None, 'take over shards claimed this many seconds ago and still not finished')
+flags.DEFINE_boolean('crn', False, 'replay the same reward tapes to every policy in a trial')
+flags.DEFINE_string('paired', None, 'draw paired regret differences to this learner (use with --crn)')
+flags.DEFINE_integer('block', 1024, 'number of rewards drawn at a time for every arm')
+flags.DEFINE_boolean('array_bandit', False, 'keep the arms of the bandit in arrays, much faster for many arms')
+flags.DEFINE_integer('feedback_every', 1, 'deliver the rewards in bulk every this many steps')
+flags.DEFINE_boolean('profile', False, 'time choice, pull, update, regret and writing of every policy')
+flags.DEFINE_integer('profile_sample', 0, 'with --profile, put every n-th decision latency into a histogram')
+flags.DEFINE_string('profile_out', None, 'with --profile, dump the profile to this json file')
+flags.DEFINE_integer('catalogue', 0, 'learn LinUCB on a catalogue of this many items with candidates every round')
+flags.DEFINE_integer('candidates', 0, 'number of candidate items of every round, 0 for the whole catalogue')
+flags.DEFINE_integer('mips_k', 0,
+                     'pre-filter the whole catalogue to this many items by the inner product index, 0 to score all')
+flags.DEFINE_integer('mips_lists', None,
+                     'number of lists of the inner product index, by default about sqrt of the items')
+flags.DEFINE_integer('mips_probes', 8, 'number of lists of the inner product index searched by every decision')
+flags.DEFINE_integer('churn', 0, 'number of catalogue items replaced by new ones every round')
+flags.DEFINE_boolean('sweep', False, 'run every configuration of the grids on the same bandits and write a tidy table')
+flags.DEFINE_string('sweep_out', 'sweep.csv', 'csv file for the table of the sweep')
+flags.DEFINE_list('armnum_grid', None, 'numbers of arms to sweep over, by default --armnum')
 
 # flag of hyperparameters
 flags.DEFINE_float('alpha', 0.5, 'the hyper-parameter for UCB')
 flags.DEFINE_float('alpha_LinUCB', 0.1, 'the hyper-parameter for LinUCB')
+flags.DEFINE_list('alpha_grid', None, 'values of alpha to sweep over, by default --alpha')
+flags.DEFINE_list('alpha_LinUCB_grid', None, 'values of alpha_LinUCB to sweep over, by default --alpha_LinUCB')
+
+
+def run_trial(policy, rng, T, horizons, armnum, inputnum, dim, dtype, block, feedback_every, array_bandit, trace=False):
+    # run one trial of the policy on inputnum random bandits drawn from rng and
+    # return the minimax regrets of all reported horizons. With trace, also
+    # return the actions and the means of the arms of every bandit.
+    minimax_regret = dict()
+    actions = []
+    means = []
+
+    for _ in range(inputnum):
+        contexts = sphere_sampling(dim, armnum, dtype, rng)
+        theta = np.zeros(dim)
+        theta[0] = 1
+        bandit_class = ArrayLinearBandit if array_bandit else LinearBandit
+        bandit = instrument(bandit_class(contexts, theta, rng, block))
+        # initialization
+        bandit.init()
+        policy.init(contexts)
+        actions.append([] if trace else None)
+        means.append(np.asarray(contexts) @ theta)
+        agg_regret = play(policy, bandit, T, horizons, feedback_every, actions[-1])
+        for t in agg_regret:
+            minimax_regret[t] = max(minimax_regret.get(t, 0), agg_regret[t])
+
+    if trace:
+        return minimax_regret, np.array(actions, dtype=action_dtype(armnum)), np.array(means)
+    return minimax_regret
+
+
+def run_catalogue_trial(policy, rng, T, horizons, items, inputnum, dim, dtype, block, candidates, mips_k, lists,
+                        probes, churn):
+    # run one trial of LinUCB on inputnum random catalogues drawn from rng,
+    # with fresh candidates every round, and return the minimax regrets
+    minimax_regret = dict()
+    reported = set(horizons)
+
+    for _ in range(inputnum):
+        theta = np.zeros(dim)
+        theta[0] = 1
+        bandit = instrument(CatalogueBandit(sphere_sampling(dim, items, dtype, rng), theta, rng, candidates, block))
+        index = None
+        if mips_k and not candidates:
+            index = IVFIndex(dim, lists, probes, rng=rng, dtype=dtype)
+            index.add(bandit.items)
+        bandit.init()
+        policy.init_rounds(dim, items)
+
+        regrets = {0: bandit.regret(0)}
+        rewards = 0
+        for t in range(1, T + 1):
+            if churn:
+                ids = rng.integers(items, size=churn)
+                vectors = sphere_sampling(dim, churn, dtype, rng)
+                bandit.replace(ids, vectors)
+                if index is not None:
+                    index.update(ids, vectors)
+            ids = bandit.round()
+            if ids is not None:
+                item = int(ids[policy.choose(t, bandit.items[ids])])
+            elif index is not None:
+                item = policy.choose_index(t, index, mips_k)
+            else:
+                item = policy.choose(t, bandit.items)
+            reward = bandit.pull_arm(item)
+            policy.update_context(reward, bandit.items[item])
+            rewards += reward
+            if t in reported:
+                regrets[t] = bandit.regret(rewards)
+        for t in regrets:
+            minimax_regret[t] = max(minimax_regret.get(t, 0), regrets[t])
+
+    return minimax_regret
+
+
+def run_sweep(T, horizons, inputnum, dtype):
+    # every configuration is a policy of the same run, and with common random
+    # numbers all configurations of a trial face the same bandits and rewards
+    configs = [(MultiUCB(float(value), FLAGS.ucb_heap), 'alpha', float(value))
+               for value in FLAGS.alpha_grid or [FLAGS.alpha]]
+    configs += [(LinUCB(float(value), T, dtype), 'alpha_LinUCB', float(value))
+                for value in FLAGS.alpha_LinUCB_grid or [FLAGS.alpha_LinUCB]]
+    armnums = [int(armnum) for armnum in FLAGS.armnum_grid or [FLAGS.armnum]]
+    policies = [policy for policy, _, _ in configs]
+
+    trial_fns = [functools.partial(run_trial, T=T, horizons=horizons, armnum=armnum, inputnum=inputnum,
+                                   dim=FLAGS.dim, dtype=dtype, block=FLAGS.block,
+                                   feedback_every=FLAGS.feedback_every, array_bandit=FLAGS.array_bandit)
+                 for armnum in armnums]
+
+    regrets = np.zeros((len(configs), len(armnums), FLAGS.trials, len(horizons)))
+    if FLAGS.shard:
+        # every number of arms is a group of units of the manifest
+        units = run_sharded([(trial_fn, policies) for trial_fn in trial_fns], True)
+        if units is None:
+            return
+    else:
+        units = []
+        for j, (armnum, trial_fn) in enumerate(zip(armnums, trial_fns)):
+            logging.info('run %d configurations on %d arms' % (len(configs), armnum))
+            units += [(j, policy, trial, result) for policy, trial, result in
+                      run_trials(trial_fn, policies, FLAGS.trials, FLAGS.seed, FLAGS.workers, crn=True)]
+    for j, policy, trial, minimax_regret in units:
+        regrets[policies.index(policy), j, trial] = [minimax_regret[t] for t in horizons]
+
+    rows = []
+    for (policy, parameter, value), config_regrets in zip(configs, regrets):
+        rows += sweep_rows(policy.name, parameter, value, ['%d arms' % armnum for armnum in armnums],
+                           config_regrets, horizons)
+    write_sweep(rows)
 
 
 def main(argv):
     del argv
 
-    if FLAGS.rm:
-        os.remove(FLAGS.out)
+    shard_setup()
+    if FLAGS.sweep and FLAGS.tol:
+        logging.fatal('Adaptive stopping is not supported with --sweep!')
+    if FLAGS.catalogue and (FLAGS.sweep or FLAGS.feedback_every > 1):
+        logging.fatal('Sweeps and delayed feedback are not supported with --catalogue!')
+    if FLAGS.shard and FLAGS.tol:
+        logging.fatal('Adaptive stopping cannot be sharded!')
+    if FLAGS.trace and (FLAGS.shard or FLAGS.sweep or FLAGS.catalogue):
+        logging.fatal('Actions can only be traced by single-host runs on bandits with fixed arms!')
+    if FLAGS.sweep or FLAGS.shard in ['plan', 'work']:
+        aggregator = None
     else:
-        if FLAGS.out in os.listdir('./'):
-            logging.fatal(('%s is not empty. Make sure you have'
-                           ' archived previously generated data. '
-                           'Try --rm flag which will automatically'
-                           ' delete previous data.') % FLAGS.out)
-
-    # for reproducing purpose
-    # np.random.seed(100)
+        aggregator = prepare_output()
 
     trials = FLAGS.trials
-    freq = FLAGS.freq
     T = FLAGS.T
+    horizons = checkpoints(T)
     inputnum = FLAGS.inputnum if FLAGS.minimax else 1
+    dtype = np.float32 if FLAGS.float32 else np.float64
+    if FLAGS.sweep:
+        run_sweep(T, horizons, inputnum, dtype)
+        return
 
     # policies to be compared
     # add your methods here
-    policies = [MultiUCB(FLAGS.alpha), LinUCB(FLAGS.alpha_LinUCB, FLAGS.T)]
-
-    for policy in policies:
-        logging.info('run policy %s' % policy.name)
-        for trial in range(trials):
-            if trial % 50 == 0:
-                logging.info('trial: %d' % trial)
-
-            minimax_regret = dict()
-
-            for _ in range(inputnum):
-                contexts = list(sphere_sampling(3, FLAGS.armnum))
-                theta = [1, 0, 0]
-                bandit = LinearBandit(contexts, theta)
-                agg_regret = dict()
-                # initialization
-                bandit.init()
-                policy.init(contexts)
-                rewards = 0
-                for t in range(0, T + 1):
-                    if t > 0:
-                        action = policy.choice(t)
-                        reward = bandit.pull_arm(action)
-                        policy.update(reward, action)
-                        rewards += reward
-                    if t % freq == 0:
-                        agg_regret[t] = bandit.regret(rewards)
-                for t in agg_regret:
-                    minimax_regret[t] = max(minimax_regret.get(t, 0), agg_regret[t])
-            # output one trial result into the output file
-            write_to_file(dict({policy.name: minimax_regret}))
-
-    # generate the final figure
-    draw()
+    policies = [MultiUCB(FLAGS.alpha, FLAGS.ucb_heap), LinUCB(FLAGS.alpha_LinUCB, FLAGS.T, dtype)]
+
+    # (policy, trial) units are run by a pool of FLAGS.workers
+    trial_fn = functools.partial(run_trial, T=T, horizons=horizons, armnum=FLAGS.armnum, inputnum=inputnum,
+                                 dim=FLAGS.dim, dtype=dtype, block=FLAGS.block,
+                                 feedback_every=FLAGS.feedback_every, array_bandit=FLAGS.array_bandit,
+                                 trace=bool(FLAGS.trace))
+    if FLAGS.catalogue:
+        # only LinUCB scores contexts it has not seen before
+        policies = [LinUCB(FLAGS.alpha_LinUCB, FLAGS.T, dtype)]
+        trial_fn = functools.partial(run_catalogue_trial, T=T, horizons=horizons, items=FLAGS.catalogue,
+                                     inputnum=inputnum, dim=FLAGS.dim, dtype=dtype, block=FLAGS.block,
+                                     candidates=FLAGS.candidates, mips_k=FLAGS.mips_k, lists=FLAGS.mips_lists,
+                                     probes=FLAGS.mips_probes, churn=FLAGS.churn)
+    if FLAGS.shard:
+        units = run_sharded([(trial_fn, policies)], FLAGS.crn)
+        if units is None:
+            return
+        record_units(((policy, trial, result) for _, policy, trial, result in units), aggregator)
+    elif FLAGS.tol:
+        run_adaptive(trial_fn, policies, aggregator)
+    else:
+        run_and_record(trial_fn, policies, aggregator)
+
+    if FLAGS.export_json and FLAGS.format == 'npy':
+        open_store(FLAGS.out).export_json(FLAGS.export_json)
+
+    # report the aggregated regrets and generate the final figure
+    log_summary(aggregator)
+    log_traces()
+    log_profile()
+    draw(FLAGS.paired)
 
 
 if __name__ == '__main__':
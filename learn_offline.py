@@ -0,0 +1,173 @@
+import functools
+from absl import app
+from absl import logging
+from absl import flags
+from learner import Greedy, EpsGreedy, ExploreThenCommit, BerUCB, TS, MultiUCB, LinUCB
+from bandit import ArrayLinearBandit
+from experiment import prepare_output, record, log_summary, checkpoints
+from offline import ReplayEvaluator, read_chunks, open_logs, log_uniform, log_uniform_contexts
+from utils import draw, open_store, sphere_sampling
+import numpy as np
+
+FLAGS = flags.FLAGS
+
+# Flags for general settings
+flags.DEFINE_list('logs', ['logs'], 'directories of logged events, replayed in order')
+flags.DEFINE_integer('chunk', 65536, 'number of logged events read at a time')
+flags.DEFINE_integer('simulate', 0, 'first log this many events of a uniform policy on a random linear bandit')
+flags.DEFINE_boolean('simulate_contexts', False, 'draw fresh contexts of the arms for every simulated event')
+flags.DEFINE_string('out', 'data.out', 'file for generated data')
+flags.DEFINE_string('fig', 'figure.png', 'file for generated figure')
+flags.DEFINE_enum('format', 'json', ['json', 'npy'], 'json lines file or a directory of columnar npy arrays')
+flags.DEFINE_string('export_json', None, 'also export the npy results to this json lines file')
+flags.DEFINE_boolean('novar', True, 'do not show std in the output figure')
+flags.DEFINE_boolean('rm', False, 'remove previously generated data')
+flags.DEFINE_boolean('resume', False, 'skip the learners recorded in the checkpoint of an interrupted run')
+flags.DEFINE_list('policies', None, 'learners to evaluate, by default all learners fitting the number of arms')
+flags.DEFINE_integer('T', 1000, 'number of steps of every learner')
+flags.DEFINE_integer('trials', 1,
+                     'number of runs of every learner, each on its own bootstrap of the logs if more than one')
+flags.DEFINE_integer('freq', 50, 'frenquency to report the intermediate regrets')
+flags.DEFINE_enum('schedule', 'uniform', ['uniform', 'log', 'explicit'],
+                  'report the regrets every --freq steps, at --log_points log-spaced horizons or at --checkpoints')
+flags.DEFINE_integer('log_points', 20, 'number of log-spaced horizons with --schedule=log')
+flags.DEFINE_list('checkpoints', None, 'horizons to report the regrets at with --schedule=explicit')
+flags.DEFINE_integer('seed', 300, 'seed of the learners and the simulated logs')
+flags.DEFINE_integer('armnum', 10, 'number of arms of the simulated logs')
+flags.DEFINE_integer('dim', 3, 'dimension of the contexts of the simulated logs')
+
+# Flags for hyper-parameters
+flags.DEFINE_float('eps', 1, 'parameter epsilon for epsilon greedy algorithm')
+flags.DEFINE_float('C', 1, 'parameter C for explore-then-commit algorithm')
+flags.DEFINE_float('alpha', 0.5, 'parameter alpha for UCB algorithm')
+flags.DEFINE_float('alpha_LinUCB', 0.1, 'parameter alpha for linear UCB algorithm')
+
+# learners by name, by default for logs of two arms and for logs of many arms
+BERNOULLI_POLICIES = ['Greedy', 'Epsilon-Greedy', 'ExploreThenCommit', 'UCB', 'TS']
+ARM_POLICIES = ['MultiUCB', 'LinUCB']
+
+
+def make_evaluator(name, arms, dim=None, trial=0):
+    # a fresh evaluator of the learner called name on the features of the
+    # arms, LinUCB choosing among the contexts of every event if the logs have
+    # contexts of dimension dim. With several trials every trial replays its
+    # own bootstrap of the logs, seeded by the trial.
+    evaluator = functools.partial(ReplayEvaluator, T=FLAGS.T, horizons=checkpoints(FLAGS.T))
+    if FLAGS.trials > 1:
+        evaluator = functools.partial(evaluator, rng=np.random.default_rng(
+            np.random.SeedSequence(FLAGS.seed, spawn_key=(trial,))))
+    if name == 'Greedy':
+        learner = Greedy(len(arms))
+    elif name == 'Epsilon-Greedy':
+        learner = EpsGreedy(FLAGS.eps, len(arms))
+    elif name == 'ExploreThenCommit':
+        learner = ExploreThenCommit(FLAGS.C, len(arms))
+        learner.init(FLAGS.T)
+        return evaluator(learner, offset=1)
+    elif name == 'UCB':
+        learner = BerUCB(FLAGS.alpha, len(arms))
+    elif name == 'TS':
+        learner = TS(len(arms))
+    elif name == 'MultiUCB':
+        learner = MultiUCB(FLAGS.alpha)
+    elif name == 'LinUCB':
+        learner = LinUCB(FLAGS.alpha_LinUCB, FLAGS.T)
+    else:
+        logging.fatal('Unknown policy %s, choose from %s' % (name, ', '.join(BERNOULLI_POLICIES + ARM_POLICIES)))
+
+    if name == 'LinUCB' and dim is not None:
+        learner.init_rounds(dim, len(arms))
+        return evaluator(learner, rounds=True)
+    if name in ARM_POLICIES:
+        learner.init(arms)
+        return evaluator(learner)
+    learner.init()
+    return evaluator(learner, offset=1)
+
+
+def main(argv):
+    del argv
+
+    if FLAGS.simulate:
+        rng = np.random.default_rng(FLAGS.seed)
+        theta = np.zeros(FLAGS.dim)
+        theta[0] = 1
+        if FLAGS.simulate_contexts:
+            log_uniform_contexts(FLAGS.logs[0], theta, FLAGS.armnum, FLAGS.simulate, rng)
+        else:
+            bandit = ArrayLinearBandit(sphere_sampling(FLAGS.dim, FLAGS.armnum, rng=rng), theta, rng)
+            bandit.init()
+            log_uniform(FLAGS.logs[0], bandit, FLAGS.armnum, FLAGS.simulate, rng)
+        logging.info('logged %d events of a uniform policy into %s' % (FLAGS.simulate, FLAGS.logs[0]))
+
+    aggregator = prepare_output()
+    np.random.seed(FLAGS.seed)
+
+    logs = open_logs(FLAGS.logs[0])
+    arms = logs['arms']
+    dim = logs['contexts'].shape[-1] if 'contexts' in logs else None
+    # the arms of contextual logs change with every event, so no fixed arm is
+    # a benchmark and the cumulative replayed rewards are recorded instead
+    quantity = 'regret' if dim is None else 'replayed reward'
+    names = FLAGS.policies or (BERNOULLI_POLICIES if len(arms) == 2 else ARM_POLICIES)
+
+    # every (learner, trial) replays the logs in the same pass
+    evaluators = [(trial, make_evaluator(name, arms, dim, trial)) for name in names for trial in range(FLAGS.trials)]
+    if len({evaluator.learner.name for _, evaluator in evaluators}) < len(set(names)):
+        logging.fatal('Learners to evaluate have to have different names!')
+    evaluators = [(trial, evaluator) for trial, evaluator in evaluators
+                  if not aggregator.done(evaluator.learner.name, trial)]
+    if not evaluators:
+        logging.info('all trials are recorded in %s already, nothing to replay' % FLAGS.out)
+        log_summary(aggregator, quantity)
+        return
+
+    # inverse propensity estimates of the mean reward of every arm, for the
+    # regret to the best arm
+    arm_rewards = np.zeros(len(arms))
+    events = 0
+    active = [evaluator for _, evaluator in evaluators]
+    for actions, rewards, propensities, contexts in read_chunks(FLAGS.logs, FLAGS.chunk):
+        arm_rewards += np.bincount(actions, weights=np.divide(rewards, propensities), minlength=len(arms))
+        events += len(actions)
+        copies = [evaluator.copies(len(actions)) for evaluator in active]
+        for i, event in enumerate(zip(actions, rewards, propensities, contexts)):
+            for evaluator, counts in zip(active, copies):
+                for _ in range(counts[i]):
+                    evaluator.feed(*event)
+        active = [evaluator for evaluator in active if not evaluator.done]
+    best = arm_rewards.max() / events
+    if dim is None:
+        logging.info('replayed %d events, best arm %d with estimated mean reward %.3f'
+                     % (events, arm_rewards.argmax(), best))
+    else:
+        logging.info('replayed %d events with contexts, recording the cumulative replayed rewards' % events)
+
+    # report the horizons reached by every learner
+    if active:
+        logging.warning('the logs ran out before %d steps of %s'
+                        % (FLAGS.T, ', '.join(sorted({evaluator.learner.name for evaluator in active}))))
+    points = min(len(evaluator.curve) for _, evaluator in evaluators)
+    horizons = np.array(checkpoints(FLAGS.T)[:points])
+    for name in dict.fromkeys(evaluator.learner.name for _, evaluator in evaluators):
+        runs = [(trial, evaluator) for trial, evaluator in evaluators if evaluator.learner.name == name]
+        regrets = np.array([evaluator.curve[:points] for _, evaluator in runs], dtype=float)
+        if dim is None:
+            regrets = horizons * best - regrets
+        record(aggregator, name, [trial for trial, _ in runs], horizons.tolist(), regrets)
+        for trial, evaluator in runs:
+            logging.info('%s trial %d: %d of %d events replayed, replay value %.3f, IPS value %.3f'
+                         % (name, trial, evaluator.steps, evaluator.events,
+                            evaluator.rewards / max(evaluator.steps, 1), evaluator.ips / max(evaluator.events, 1)))
+
+    if FLAGS.export_json and FLAGS.format == 'npy':
+        open_store(FLAGS.out).export_json(FLAGS.export_json)
+
+    # Report the aggregated regrets and generate the final figure
+    log_summary(aggregator, quantity)
+    draw(ylabel=quantity)
+
+
+# The main entry
+if __name__ == '__main__':
+    app.run(main)
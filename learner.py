@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from utils import EmArm
+from bisect import bisect_left
+from utils import ArmStats, UCBHeap
 import numpy as np
 
 
@@ -25,6 +26,33 @@ class Learner(ABC):
     def update(self, reward, action):
         pass
 
+    def choose_batch(self, time, n):
+        """
+        make n decisions at times time, ..., time + n - 1 without feedback in
+        between, e.g. for requests served together
+        """
+        return [self.choice(time + i) for i in range(n)]
+
+    def update_batch(self, actions, rewards):
+        """apply the rewards of many actions at once, in order"""
+        for action, reward in zip(actions, rewards):
+            self.update(reward, action)
+
+    def get_state(self):
+        """
+        get the learned state as a dict of numpy arrays and scalars, which
+        snapshot.py saves and loads
+        """
+        raise Exception('Snapshots are not supported by %s!' % self.name)
+
+    def set_state(self, state):
+        """restore a state of get_state(), instead of init()"""
+        raise Exception('Snapshots are not supported by %s!' % self.name)
+
+    def merge_state(self, state):
+        """add the statistics of the state of a learner trained in parallel"""
+        raise Exception('Snapshots are not supported by %s!' % self.name)
+
 
 class Uniform_Sampling(Learner):
     """
@@ -45,210 +73,364 @@ class Uniform_Sampling(Learner):
     def update(self, reward, action):
         pass
 
+    def get_state(self):
+        return {'contexts': np.asarray(self.__contexts)}
+
+    def set_state(self, state):
+        self.__contexts = state['contexts']
+
+    def merge_state(self, state):
+        # no statistics are learned, so states merge only on the same contexts
+        if not np.array_equal(np.asarray(self.__contexts), state['contexts']):
+            raise Exception('Cannot merge the states of Uniform on different contexts!')
+
 
 class Greedy(Learner):
     """
-    The class of naive greedy police (bernoulli arms only)
+    The class of naive greedy police (bernoulli arms 1 to arm_num only)
     """
 
-    def __init__(self):
-        self.__em_arm_1 = EmArm()
-        self.__em_arm_2 = EmArm()
+    def __init__(self, arm_num=2):
+        self.__arm_num = arm_num
+        self.__stats = ArmStats(arm_num)
 
     @property
     def name(self):
         return 'Greedy'
 
+    @property
+    def arm_num(self):
+        return self.__stats.arm_num
+
     def init(self):
-        self.__em_arm_1.reset()
-        self.__em_arm_2.reset()
+        self.__stats.reset()
 
     def choice(self, time):
-        if time == 1:
-            return 1
-        elif time == 2:
-            return 2
+        # pull every arm once first
+        if time <= self.__arm_num:
+            return time
         else:
-            if self.__em_arm_1.em_mean >= self.__em_arm_2.em_mean:
-                return 1
-            else:
-                return 2
+            return int(self.__stats.em_mean.argmax()) + 1
+
+    def choose_batch(self, time, n):
+        # the empirical means do not change without feedback, and arms whose
+        # feedback is still pending count as the best ones
+        first = self.__arm_num + 1
+        actions = [self.choice(t) for t in range(time, min(time + n, first))]
+        if len(actions) < n:
+            actions += [int(self.__stats.mean_or(np.inf).argmax()) + 1] * (n - len(actions))
+        return actions
 
     def update(self, reward, action):
-        if action == 1:
-            self.__em_arm_1.update(reward, reward == 1)
-        else:
-            self.__em_arm_2.update(reward, reward == 1)
+        self.__stats.update(action - 1, reward, reward == 1)
+
+    def update_batch(self, actions, rewards):
+        rewards = np.asarray(rewards)
+        self.__stats.update_many(np.asarray(actions) - 1, rewards, rewards == 1)
+
+    def get_state(self):
+        return self.__stats.state()
+
+    def set_state(self, state):
+        self.__stats.load_state(state)
+
+    def merge_state(self, state):
+        self.__stats.merge(state)
 
 
 class EpsGreedy(Learner):
     """
-    The class of greedy policy with epsilon exception (bernoulli arms only)
+    The class of greedy policy with epsilon exception (bernoulli arms 1 to
+    arm_num only)
     """
 
-    def __init__(self, epsilon):
+    def __init__(self, epsilon, arm_num=2):
         self.__eps = epsilon
-        self.__em_arm_1 = EmArm()
-        self.__em_arm_2 = EmArm()
+        self.__arm_num = arm_num
+        self.__stats = ArmStats(arm_num)
 
     @property
     def name(self):
         return 'Epsilon-Greedy'
 
+    @property
+    def arm_num(self):
+        return self.__stats.arm_num
+
     def init(self):
-        self.__em_arm_1.reset()
-        self.__em_arm_2.reset()
+        self.__stats.reset()
 
     def choice(self, time):
-        if time == 1:
-            return 1
-        elif time == 2:
-            return 2
+        if time <= self.__arm_num:
+            return time
         else:
             rnd_1 = np.random.random_sample(1)
             if rnd_1 <= (1 - self.__eps / time):
-                if self.__em_arm_1.em_mean >= self.__em_arm_2.em_mean:
-                    return 1
-                else:
-                    return 2
+                return int(self.__stats.em_mean.argmax()) + 1
             else:
+                # a uniform arm, arm k for rnd_2 in ((k-1)/K, k/K]
                 rnd_2 = np.random.random_sample(1)
-                if rnd_2 <= 0.5:
-                    return 1
-                else:
-                    return 2
+                return max(int(np.ceil(rnd_2[0] * self.__arm_num)), 1)
+
+    def choose_batch(self, time, n):
+        times = np.arange(time, time + n)
+        rnd_1, rnd_2 = np.random.random_sample((2, n))
+        # arms whose feedback is still pending count as the best ones
+        best = int(self.__stats.mean_or(np.inf).argmax()) + 1 if time + n > self.__arm_num + 1 else 1
+        explore = np.maximum(np.ceil(rnd_2 * self.__arm_num), 1).astype(np.int64)
+        actions = np.where(rnd_1 <= 1 - self.__eps / times, best, explore)
+        first = times <= self.__arm_num
+        actions[first] = times[first]
+        return actions.tolist()
 
     def update(self, reward, action):
-        if action == 1:
-            self.__em_arm_1.update(reward, reward == 1)
-        else:
-            self.__em_arm_2.update(reward, reward == 1)
+        self.__stats.update(action - 1, reward, reward == 1)
+
+    def update_batch(self, actions, rewards):
+        rewards = np.asarray(rewards)
+        self.__stats.update_many(np.asarray(actions) - 1, rewards, rewards == 1)
+
+    def get_state(self):
+        return self.__stats.state()
+
+    def set_state(self, state):
+        self.__stats.load_state(state)
+
+    def merge_state(self, state):
+        self.__stats.merge(state)
 
 
 class ExploreThenCommit(Learner):
     """
-    The class of explore-then-commit policy (bernoulli arms only)
+    The class of explore-then-commit policy (bernoulli arms 1 to arm_num only).
+    The exploration pulls every arm in turn for about C * T^(2/3) / arm_num
+    steps. Arms left unexplored by a short exploration are never committed to.
     """
 
-    def __init__(self, C):
+    def __init__(self, C, arm_num=2):
         self.__C = C
-        self.__em_arm_1 = EmArm()
-        self.__em_arm_2 = EmArm()
+        self.__arm_num = arm_num
+        self.__stats = ArmStats(arm_num)
         self.__trial_time = 0
+        self.__bounds = [0] * (arm_num + 1)
+        self.__commit = None
 
     @property
     def name(self):
         return 'ExploreThenCommit'
 
+    @property
+    def arm_num(self):
+        return self.__stats.arm_num
+
     def init(self, total_time):
-        self.__em_arm_1.reset()
-        self.__em_arm_2.reset()
+        self.__stats.reset()
         self.__trial_time = self.__C * np.power(total_time, 2 / 3)
+        self.__commit = None
+        self.__set_bounds()
+
+    def __set_bounds(self):
+        # arm k is explored at the times in (bounds[k-1], bounds[k]]
+        self.__bounds = np.ceil(self.__trial_time * np.arange(self.__arm_num + 1) / self.__arm_num).tolist()
 
     def choice(self, time):
-        if time <= np.ceil(self.__trial_time / 2):
-            return 1
-        elif (time > np.ceil(self.__trial_time / 2)) and (time <= np.ceil(self.__trial_time)):
-            return 2
+        if time <= self.__bounds[-1]:
+            return bisect_left(self.__bounds, time)
 
         else:
-            if self.__em_arm_1.em_mean >= self.__em_arm_2.em_mean:
-                return 1
-            else:
-                return 2
+            # commit to the empirically best arm at the end of exploration
+            if self.__commit is None:
+                self.__commit = int(self.__stats.mean_or(-np.inf).argmax()) + 1
+            return self.__commit
+
+    def choose_batch(self, time, n):
+        # the decisions only depend on time, so only the first decision of the
+        # commit phase has to be made by choice()
+        times = np.arange(time, time + n)
+        actions = np.searchsorted(self.__bounds, times)
+        committed = times > self.__bounds[-1]
+        if committed.any():
+            actions[committed] = self.choice(int(times[committed][0]))
+        return actions.tolist()
 
     def update(self, reward, action):
-        if action == 1:
-            self.__em_arm_1.update(reward, reward == 1)
+        self.__stats.update(action - 1, reward, reward == 1)
+
+    def update_batch(self, actions, rewards):
+        rewards = np.asarray(rewards)
+        self.__stats.update_many(np.asarray(actions) - 1, rewards, rewards == 1)
+
+    def get_state(self):
+        state = dict(self.__stats.state())
+        state['trial_time'] = self.__trial_time
+        state['commit'] = self.__commit
+        return state
+
+    def set_state(self, state):
+        self.__stats.load_state(state)
+        self.__trial_time = state['trial_time']
+        self.__commit = state['commit']
+        self.__set_bounds()
+
+    def merge_state(self, state):
+        self.__stats.merge(state)
+
+    def explore_pulls(self, total_time):
+        """numbers of exploration pulls of every arm (a row each) for the given horizons"""
+        total_time = np.asarray(total_time)
+        trial_time = self.__C * np.power(total_time, 2 / 3)
+        steps = np.arange(self.__arm_num + 1).reshape((-1,) + (1,) * total_time.ndim)
+        bounds = np.minimum(np.ceil(trial_time * steps / self.__arm_num), total_time)
+        return np.diff(bounds, axis=0).astype(np.int64)
+
+    def regrets(self, bandit, horizons, expected=False):
+        """
+        Compute the regrets of all horizons at once. Every horizon is played on
+        the first pulls of the same reward tapes of the bandit, so one tape per
+        arm and its cumulative sums serve every horizon, the same as running
+        choice() and update() for each horizon on rewound tapes. With expected
+        the realized rewards of the commit phase are replaced by their mean.
+        """
+        horizons = np.asarray(horizons, dtype=np.int64)
+        mus = np.array(bandit.mus)
+        sums = np.zeros((self.__arm_num, horizons.max() + 1))
+        np.cumsum(bandit.tapes(horizons.max()), axis=1, out=sums[:, 1:])
+
+        explore = self.explore_pulls(horizons)
+        explore_rewards = np.take_along_axis(sums, explore, axis=1)
+        em_mean = np.divide(explore_rewards, explore, out=np.full(explore.shape, -np.inf), where=explore > 0)
+        commit = em_mean.argmax(axis=0)
+        commit_pulls = horizons - explore.sum(axis=0)
+
+        rewards = explore_rewards.sum(axis=0)
+        if expected:
+            rewards += commit_pulls * mus[commit]
         else:
-            self.__em_arm_2.update(reward, reward == 1)
+            start = explore[commit, np.arange(len(horizons))]
+            rewards += sums[commit, start + commit_pulls] - sums[commit, start]
+        return horizons * mus.max() - rewards
 
 
 class BerUCB(Learner):
     """
-    The class of Upper Confidence Bound (UCB) policy (bernoulli arms only)
+    The class of Upper Confidence Bound (UCB) policy (bernoulli arms 1 to
+    arm_num only)
     """
 
-    def __init__(self, alpha):
+    def __init__(self, alpha, arm_num=2):
         self.__alpha = alpha
-        self.__em_arm_1 = EmArm()
-        self.__em_arm_2 = EmArm()
+        self.__arm_num = arm_num
+        self.__stats = ArmStats(arm_num)
 
     @property
     def name(self):
         return 'UCB'
 
+    @property
+    def arm_num(self):
+        return self.__stats.arm_num
+
     def init(self):
-        self.__em_arm_1.reset()
-        self.__em_arm_2.reset()
+        self.__stats.reset()
 
     def choice(self, time):
-        if time == 1:
-            return 1
-        elif time == 2:
-            return 2
+        if time <= self.__arm_num:
+            return time
         else:
-            pulls_1 = self.__em_arm_1.pulls
-            pulls_2 = self.__em_arm_2.pulls
-            upper_1 = self.__em_arm_1.em_mean + self.__alpha * np.sqrt(2 * np.log(time - 1) / pulls_1)
-            upper_2 = self.__em_arm_2.em_mean + self.__alpha * np.sqrt(2 * np.log(time - 1) / pulls_2)
-            if upper_1 >= upper_2:
-                return 1
-            else:
-                return 2
+            return int(self.__stats.ucb(time, self.__alpha).argmax()) + 1
+
+    def choose_batch(self, time, n):
+        times = np.arange(time, time + n)
+        actions = times.copy()
+        later = times > self.__arm_num
+        if later.any():
+            # upper confidence bounds of all decisions at once, one row each;
+            # arms without feedback yet have infinite bounds
+            stats = self.__stats
+            bonus = np.sqrt(2 * np.log(times[later] - 1))[:, None] * stats.widths()
+            actions[later] = (stats.mean_or(np.inf) + self.__alpha * bonus).argmax(axis=1) + 1
+        return actions.tolist()
 
     def update(self, reward, action):
-        if action == 1:
-            self.__em_arm_1.update(reward, reward == 1)
-        else:
-            self.__em_arm_2.update(reward, reward == 1)
+        self.__stats.update(action - 1, reward, reward == 1)
+
+    def update_batch(self, actions, rewards):
+        rewards = np.asarray(rewards)
+        self.__stats.update_many(np.asarray(actions) - 1, rewards, rewards == 1)
+
+    def get_state(self):
+        return self.__stats.state()
+
+    def set_state(self, state):
+        self.__stats.load_state(state)
+
+    def merge_state(self, state):
+        self.__stats.merge(state)
 
 
 class TS(Learner):
     """
-    The class of Thompson sampling policy (bernoulli arms only)
+    The class of Thompson sampling policy (bernoulli arms 1 to arm_num only)
     """
 
-    def __init__(self):
-        self.__em_arm_1 = EmArm()
-        self.__em_arm_2 = EmArm()
+    # up to this many arms, scalar draws beat one draw with array parameters
+    SCALAR_ARMS = 8
+
+    def __init__(self, arm_num=2):
+        self.__stats = ArmStats(arm_num)
 
     @property
     def name(self):
         return 'TS'
 
+    @property
+    def arm_num(self):
+        return self.__stats.arm_num
+
     def init(self):
-        self.__em_arm_1.reset()
-        self.__em_arm_2.reset()
+        self.__stats.reset()
 
     def choice(self, time):
-        good_pulls_1 = self.__em_arm_1.good_pulls
-        good_pulls_2 = self.__em_arm_2.good_pulls
-        bad_pulls_1 = self.__em_arm_1.pulls - self.__em_arm_1.good_pulls
-        bad_pulls_2 = self.__em_arm_2.pulls - self.__em_arm_2.good_pulls
+        # scalar draws are much cheaper than one draw with array parameters for
+        # a few arms, and give the same samples
+        alpha, beta = self.__stats.posterior()
+        if len(alpha) > self.SCALAR_ARMS:
+            return int(np.random.beta(alpha, beta).argmax()) + 1
+        est = [np.random.beta(a, b) for a, b in zip(alpha.tolist(), beta.tolist())]
+        return est.index(max(est)) + 1
+
+    def choose_batch(self, time, n):
+        # one draw from the posteriors of all arms per decision
+        alpha, beta = self.__stats.posterior()
+        return (np.random.beta(alpha, beta, size=(n, len(alpha))).argmax(axis=1) + 1).tolist()
 
-        est_1 = np.random.beta(1 + good_pulls_1, 1 + bad_pulls_1, 1)
-        est_2 = np.random.beta(1 + good_pulls_2, 1 + bad_pulls_2, 1)
+    def update(self, reward, action):
+        self.__stats.update(action - 1, reward, reward == 1)
 
-        if est_1 >= est_2:
-            return 1
-        else:
-            return 2
+    def update_batch(self, actions, rewards):
+        rewards = np.asarray(rewards)
+        self.__stats.update_many(np.asarray(actions) - 1, rewards, rewards == 1)
 
-    def update(self, reward, action):
-        if action == 1:
-            self.__em_arm_1.update(reward, reward == 1)
-        else:
-            self.__em_arm_2.update(reward, reward == 1)
+    def get_state(self):
+        return self.__stats.state()
+
+    def set_state(self, state):
+        self.__stats.load_state(state)
+
+    def merge_state(self, state):
+        self.__stats.merge(state)
 
 
 class MultiUCB(Learner):
     """
-    The class of Upper Confidence Bound (UCB) policy (multi-arms)
+    The class of Upper Confidence Bound (UCB) policy (multi-arms). With
+    heap=True the best arm is kept in a UCBHeap instead of scanning all arms
+    every round, which pays off for very large numbers of arms.
     """
 
-    def __init__(self, alpha):
+    def __init__(self, alpha, heap=False):
         self.__alpha = alpha
+        self.__use_heap = heap
 
     @property
     def name(self):
@@ -256,63 +438,184 @@ class MultiUCB(Learner):
 
     def init(self, contexts):
         self.__dim = len(contexts)
-        self.__em_arm = [EmArm() for i in range(self.__dim)]
+        self.__stats = ArmStats(self.__dim)
+        self.__heap = UCBHeap(self.__stats, self.__alpha) if self.__use_heap else None
 
     def choice(self, time):
         if time <= self.__dim:
             return time - 1
 
+        elif self.__heap is not None:
+            return self.__heap.argmax(time)
         else:
-            max_recorder = [0, 0]
-            for i in range(self.__dim):
-                which_arm = self.__em_arm[i]
-                upper = which_arm.em_mean + \
-                        self.__alpha * np.sqrt(2 * np.log(time - 1) / which_arm.pulls)
-                if upper >= max_recorder[1]:
-                    max_recorder = [i, upper]
-            return max_recorder[0]
+            return int(self.__stats.ucb(time, self.__alpha).argmax())
+
+    def choose_batch(self, time, n):
+        stats = self.__stats
+        if time + n - 1 <= self.__dim or (self.__heap is not None and stats.pulls.all()):
+            return super().choose_batch(time, n)
+        # means and widths are shared by all decisions, only log(t) changes;
+        # arms without feedback yet have infinite indices
+        actions = list(range(time - 1, min(time + n - 1, self.__dim)))
+        em_mean, width = stats.mean_or(np.inf), stats.widths()
+        for t in range(time + len(actions), time + n):
+            actions.append(int((em_mean + self.__alpha * np.sqrt(2 * np.log(t - 1)) * width).argmax()))
+        return actions
 
     def update(self, reward, action):
         """No need to define good/bad pulls. Automatically good pulls entered"""
-        self.__em_arm[action].update(reward, True)
+        self.__stats.update(action, reward, True)
+        if self.__heap is not None:
+            self.__heap.update(action)
+
+    def update_batch(self, actions, rewards):
+        actions = np.asarray(actions)
+        self.__stats.update_many(actions, np.asarray(rewards, dtype=np.float64), np.ones(len(actions), dtype=bool))
+        if self.__heap is not None:
+            for action in np.unique(actions).tolist():
+                self.__heap.update(action)
+
+    def get_state(self):
+        return self.__stats.state()
+
+    def set_state(self, state):
+        self.__stats = ArmStats(len(state['pulls']))
+        self.__stats.load_state(state)
+        self.__dim = self.__stats.arm_num
+        # a fresh heap is rebuilt from the restored statistics by the next choice
+        self.__heap = UCBHeap(self.__stats, self.__alpha) if self.__use_heap else None
+
+    def merge_state(self, state):
+        self.__stats.merge(state)
+        if self.__heap is not None:
+            # all keys are stale, so the heap is rebuilt by the next choice
+            self.__heap = UCBHeap(self.__stats, self.__alpha)
 
 
 class LinUCB(Learner):
     """
-    This class is to learn linear contextual bandits
+    This class is to learn linear contextual bandits. The feature dimension is
+    taken from the contexts, and dtype=np.float32 halves the memory and time of
+    the matrix products at large dimensions. After init_rounds() instead of
+    init(), every round brings its own candidates: choose() scores the given
+    contexts, choose_index() searches a large catalogue held in an IVFIndex,
+    and update_context() learns from the chosen context.
     """
 
-    def __init__(self, alpha, T):
+    def __init__(self, alpha, T, dtype=np.float64):
         self.__alpha = alpha
         self.__T = T
+        self.__dtype = dtype
 
     @property
     def name(self):
         return 'LinUCB'
 
     def init(self, contexts):
-        self.__contexts = contexts
-        self.__dim = len(contexts)
-        self.__A = np.eye(3)
-        self.__b = np.zeros(3)
+        # contexts are stacked into one matrix so that all arms are scored by
+        # a single matrix product, and the inverse of A is maintained directly,
+        # next to A itself which snapshots hold exactly
+        self.__contexts = np.array(contexts, dtype=self.__dtype)
+        self.__reset(*self.__contexts.shape)
+
+    def init_rounds(self, dim, arm_num):
+        """
+        init for fresh candidate contexts of dimension dim every round,
+        arm_num (e.g. the size of the catalogue) setting the width of the
+        confidence bounds
+        """
+        self.__contexts = np.zeros((0, dim), dtype=self.__dtype)
+        self.__reset(arm_num, dim)
+
+    def __reset(self, arm_num, dim):
+        self.__arm_num, self.__dim = arm_num, dim
+        self.__A = np.eye(self.__dim, dtype=self.__dtype)
+        self.__A_inv = np.eye(self.__dim, dtype=self.__dtype)
+        self.__b = np.zeros(self.__dim, dtype=self.__dtype)
+        self.__width = self.__alpha * np.sqrt(np.log(self.__arm_num * self.__T ** 2))
+
+    def __upper(self, contexts):
+        # upper confidence bounds of the rows of contexts
+        est_theta = self.__A_inv @ self.__b
+        norms = np.einsum('ij,ij->i', contexts @ self.__A_inv, contexts)
+        return contexts @ est_theta + self.__width * np.sqrt(norms)
 
     def choice(self, time):
-        A_inv = np.linalg.inv(self.__A)
-        est_theta = A_inv @ self.__b
-
-        max_recorder = [0, 0]
-        for i in range(self.__dim):
-            which_context = np.array(self.__contexts[i])
-            upper = which_context @ est_theta + \
-                    self.__alpha * np.sqrt(which_context @ A_inv @ which_context) * \
-                    np.sqrt(np.log(self.__dim * self.__T ** 2))
-
-            if upper >= max_recorder[1]:
-                max_recorder = [i, upper]
-
-        return max_recorder[0]
+        return int(self.__upper(self.__contexts).argmax())
+
+    def choose(self, time, contexts):
+        """choose among the candidate contexts of this round, return the row"""
+        return int(self.__upper(np.asarray(contexts, dtype=self.__dtype)).argmax())
+
+    def choose_index(self, time, index, k):
+        """
+        choose an item of the catalogue held in index: the k items with the
+        largest estimated rewards are found by the approximate inner product
+        search and only they are scored exactly by their upper confidence
+        bounds. Return the number of the item.
+        """
+        query = self.__A_inv @ self.__b
+        ids = index.search(query, k)
+        if not len(ids):
+            # the probed lists may hold no live item, e.g. after removals
+            ids = index.exact(query, k)
+        if not len(ids):
+            raise Exception('No item in the index to choose from!')
+        return int(ids[self.__upper(index.vectors[ids].astype(self.__dtype, copy=False)).argmax()])
 
     def update(self, reward, action):
-        which_context = np.array(self.__contexts[action])
+        self.update_context(reward, self.__contexts[action])
+
+    def update_context(self, reward, context):
+        """learn the reward of a context, e.g. chosen by choose() or choose_index()"""
+        # Sherman-Morrison rank-one update of the inverse of A + x x^T
+        which_context = np.asarray(context, dtype=self.__dtype)
+        A_inv_x = self.__A_inv @ which_context
+        A_inv_x /= np.sqrt(1 + which_context @ A_inv_x)
+        self.__A_inv -= np.outer(A_inv_x, A_inv_x)
         self.__A += np.outer(which_context, which_context)
         self.__b += reward * which_context
+
+    def choose_batch(self, time, n):
+        # the upper confidence bounds do not depend on time
+        return [self.choice(time)] * n
+
+    def update_batch(self, actions, rewards):
+        # Woodbury rank-k update of the inverse of A + X^T X, X being the k
+        # contexts of the actions, or a fresh inverse when k exceeds dim
+        contexts = self.__contexts[np.asarray(actions)]
+        rewards = np.asarray(rewards, dtype=self.__dtype)
+        self.__A += contexts.T @ contexts
+        if len(contexts) >= self.__dim:
+            self.__A_inv = np.linalg.inv(self.__A).astype(self.__dtype)
+        else:
+            A_inv_X = self.__A_inv @ contexts.T
+            inner = np.eye(len(contexts), dtype=self.__dtype) + contexts @ A_inv_X
+            self.__A_inv -= A_inv_X @ np.linalg.solve(inner, A_inv_X.T)
+        self.__b += rewards @ contexts
+
+    def get_state(self):
+        return {'contexts': self.__contexts, 'A': self.__A, 'b': self.__b, 'arm_num': self.__arm_num}
+
+    @staticmethod
+    def __A_of(state):
+        # snapshots written before A was kept hold its inverse only
+        return state['A'] if 'A' in state else np.linalg.inv(state['A_inv'])
+
+    def set_state(self, state):
+        self.__contexts = np.asarray(state['contexts'], dtype=self.__dtype)
+        self.__arm_num, self.__dim = state.get('arm_num', len(self.__contexts)), self.__contexts.shape[1]
+        self.__A = np.array(self.__A_of(state), dtype=self.__dtype)
+        self.__A_inv = np.linalg.inv(self.__A).astype(self.__dtype)
+        self.__b = np.asarray(state['b'], dtype=self.__dtype)
+        self.__width = self.__alpha * np.sqrt(np.log(self.__arm_num * self.__T ** 2))
+
+    def merge_state(self, state):
+        # A = I + sum of x x^T over all pulls, so the identity of the prior is
+        # counted once when the A of two shards are added, and the sum is
+        # inverted once
+        if not np.array_equal(self.__contexts, state['contexts']):
+            raise Exception('Cannot merge LinUCB states of different contexts!')
+        self.__A = (self.__A + self.__A_of(state) - np.eye(self.__dim)).astype(self.__dtype)
+        self.__A_inv = np.linalg.inv(self.__A).astype(self.__dtype)
+        self.__b = self.__b + state['b']
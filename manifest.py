@@ -0,0 +1,98 @@
+import json
+import os
+import socket
+import time
+import numpy as np
+
+# A manifest directory holds manifest.json, listing the shards of an
+# experiment and the flags it was planned with, a claims/ directory with one
+# file per shard taken by a worker and a results/ directory with one json
+# file per finished shard. A shard is a range of trials of one policy of one
+# group of units (e.g. an environment of a sweep); the seed of every unit is
+# derived from the master seed, the policy and the trial as in a
+# single-process run, so the results do not depend on who runs a shard.
+MANIFEST = 'manifest.json'
+
+
+def _write_json(path, data):
+    # write atomically, so that readers never see a partial file
+    with open(path + '.tmp.%d' % os.getpid(), 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp.%d' % os.getpid(), path)
+
+
+def _shard_file(directory, kind, shard):
+    return os.path.join(directory, kind, '%06d.json' % shard)
+
+
+def plan(directory, program, flag_values, groups, trials, shard_trials):
+    """
+    write the manifest of the units of groups, a list of numbers of policies,
+    split into shards of at most shard_trials trials of one policy each
+    """
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        raise Exception('%s already holds a manifest!' % directory)
+    shards = [{'group': group, 'policy': policy, 'trials': [start, min(start + shard_trials, trials)]}
+              for group, policies in enumerate(groups) for policy in range(policies)
+              for start in range(0, trials, shard_trials)]
+    for kind in ['claims', 'results']:
+        os.makedirs(os.path.join(directory, kind), exist_ok=True)
+    manifest = {'program': program, 'flags': flag_values, 'groups': groups, 'trials': trials, 'shards': shards}
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+    return manifest
+
+
+def load(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def done(directory, shard):
+    return os.path.exists(_shard_file(directory, 'results', shard))
+
+
+def claim(directory, shard, stale=None):
+    """
+    try to take shard for this process, return whether it succeeded. The
+    claim file is created exclusively, so only one process gets a shard; a
+    claim older than stale seconds without results is taken over, in which
+    case a shard may run twice with the same results.
+    """
+    path = _shard_file(directory, 'claims', shard)
+    if stale is not None and os.path.exists(path) and time.time() - os.path.getmtime(path) > stale:
+        try:
+            os.rename(path, '%s.stale.%s.%d' % (path, socket.gethostname(), os.getpid()))
+        except FileNotFoundError:
+            return False
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+    return True
+
+
+def save(directory, shard, results):
+    """write the results of shard, a list of (trial, dict from horizons to regrets)"""
+    pairs = [[trial, [[int(t), value.item() if isinstance(value, np.generic) else value]
+                      for t, value in regrets.items()]] for trial, regrets in results]
+    _write_json(_shard_file(directory, 'results', shard), pairs)
+
+
+def merge(directory):
+    """
+    read the results of all shards, return a dict from (group, policy, trial)
+    to the dict from horizons to regrets of the unit
+    """
+    manifest = load(directory)
+    missing = [i for i in range(len(manifest['shards'])) if not done(directory, i)]
+    if missing:
+        raise Exception('%d of %d shards of %s are not finished, e.g. shard %d!'
+                        % (len(missing), len(manifest['shards']), directory, missing[0]))
+    results = dict()
+    for i, shard in enumerate(manifest['shards']):
+        with open(_shard_file(directory, 'results', i)) as f:
+            for trial, pairs in json.load(f):
+                results[(shard['group'], shard['policy'], trial)] = dict((t, value) for t, value in pairs)
+    return results
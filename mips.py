@@ -0,0 +1,172 @@
+import numpy as np
+
+
+def top_k(scores, k):
+    """indices of the k largest scores, from the largest"""
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class IVFIndex():
+    """
+    Approximate maximum inner product search over item vectors with an
+    inverted file. The items are clustered by k-means into lists around
+    centroids (about sqrt of the number of items by default), and a query only
+    scores the items of the probes lists whose centroids have the largest
+    inner products with it. Items are numbered in the order they are added and
+    can be added, moved and removed at any time: they go to the list of the
+    nearest current centroid, and the centroids are retrained once more than
+    retrain times the number of items changed since the last training.
+    """
+
+    def __init__(self, dim, lists=None, probes=8, retrain=0.2, rng=None, dtype=np.float64, chunk=8192):
+        self.__dim = dim
+        self.__lists_arg = lists
+        self.__probes = probes
+        self.__retrain = retrain
+        self.__rng = np.random.default_rng() if rng is None else rng
+        self.__dtype = dtype
+        self.__chunk = chunk
+        self.__vectors = np.zeros((0, dim), dtype=dtype)
+        self.__alive = np.zeros(0, dtype=bool)
+        self.__assign = np.zeros(0, dtype=np.int64)
+        self.__centroids = np.zeros((0, dim), dtype=dtype)
+        self.__members = []
+        self.__pending = []
+        self.__stale = set()
+        self.__trained = 0
+        self.__changes = 0
+
+    @property
+    def vectors(self):
+        """vectors of all items ever added, indexed by item"""
+        return self.__vectors
+
+    @property
+    def size(self):
+        return int(self.__alive.sum())
+
+    @property
+    def lists(self):
+        return len(self.__centroids)
+
+    @property
+    def probes(self):
+        return self.__probes
+
+    @probes.setter
+    def probes(self, probes):
+        self.__probes = probes
+
+    def add(self, vectors):
+        """add items and return their numbers"""
+        vectors = np.asarray(vectors, dtype=self.__dtype).reshape(-1, self.__dim)
+        ids = np.arange(len(self.__vectors), len(self.__vectors) + len(vectors))
+        self.__vectors = np.concatenate([self.__vectors, vectors])
+        self.__alive = np.concatenate([self.__alive, np.ones(len(vectors), dtype=bool)])
+        self.__assign = np.concatenate([self.__assign, np.full(len(vectors), -1, dtype=np.int64)])
+        self.__changed(ids)
+        return ids
+
+    def update(self, ids, vectors):
+        """replace the vectors of existing items"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.__vectors[ids] = vectors
+        self.__changed(ids[self.__alive[ids]])
+
+    def remove(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self.__stale.update(self.__assign[ids].tolist())
+        self.__alive[ids] = False
+        self.__assign[ids] = -1
+        self.__changes += len(ids)
+
+    def train(self):
+        """run k-means on (a sample of) the items and put every item into its list again"""
+        live = np.flatnonzero(self.__alive)
+        lists = min(self.__lists_arg or max(1, int(np.sqrt(len(live)))), len(live))
+        if lists == 0:
+            return
+        sample = live if len(live) <= 64 * lists else self.__rng.choice(live, 64 * lists, replace=False)
+        points = self.__vectors[sample]
+        centroids = points[self.__rng.choice(len(points), lists, replace=False)]
+        for _ in range(10):
+            labels = self.__nearest(points, centroids)
+            counts = np.bincount(labels, minlength=lists)
+            sums = np.stack([np.bincount(labels, points[:, j], lists) for j in range(self.__dim)], axis=1)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.__centroids = centroids.astype(self.__dtype)
+        self.__members = [np.zeros(0, dtype=np.int64) for _ in range(lists)]
+        self.__pending = [[] for _ in range(lists)]
+        self.__stale = set()
+        self.__assign[live] = -1
+        self.__place(live)
+        self.__trained = len(live)
+        self.__changes = 0
+
+    def search(self, query, k):
+        """numbers of (about) the k items with the largest inner products with query, from the largest"""
+        if self.__changes:
+            self.__maybe_train()
+        if not len(self.__centroids):
+            return np.zeros(0, dtype=np.int64)
+        query = np.asarray(query, dtype=self.__dtype)
+        probed = top_k(self.__centroids @ query, self.__probes)
+        ids = np.concatenate([self.__list(l) for l in probed.tolist()])
+        return ids[top_k(self.__vectors[ids] @ query, k)]
+
+    def exact(self, query, k):
+        """numbers of the k items with the largest inner products with query, scoring every item"""
+        live = np.flatnonzero(self.__alive)
+        return live[top_k(self.__vectors[live] @ np.asarray(query, dtype=self.__dtype), k)]
+
+    def __nearest(self, points, centroids):
+        # nearest centroids by squared distance, in chunks to bound the memory
+        norms = np.einsum('ij,ij->i', centroids, centroids)
+        scaled = -2 * centroids.T
+        labels = []
+        for start in range(0, len(points), self.__chunk):
+            distances = points[start:start + self.__chunk] @ scaled
+            distances += norms
+            labels.append(distances.argmin(axis=1))
+        return np.concatenate(labels)
+
+    def __place(self, ids):
+        # assign items to the lists of their nearest centroids; stale entries
+        # of the lists they leave are dropped when those lists are searched
+        if not len(ids):
+            return
+        labels = self.__nearest(self.__vectors[ids], self.__centroids)
+        self.__stale.update(self.__assign[ids].tolist())
+        self.__assign[ids] = labels
+        order = np.argsort(labels, kind='stable')
+        lists, starts = np.unique(labels[order], return_index=True)
+        for l, group in zip(lists.tolist(), np.split(ids[order], starts[1:])):
+            self.__pending[l].append(group)
+
+    def __list(self, l):
+        # the live items of list l, merging the pending ones and dropping the
+        # items which left the list since it was last searched
+        if not self.__pending[l] and l not in self.__stale:
+            return self.__members[l]
+        ids = np.concatenate([self.__members[l]] + self.__pending[l])
+        self.__pending[l] = []
+        self.__stale.discard(l)
+        ids = np.unique(ids[self.__alive[ids] & (self.__assign[ids] == l)])
+        self.__members[l] = ids
+        return ids
+
+    def __changed(self, ids):
+        self.__changes += len(ids)
+        if not self.__maybe_train():
+            self.__place(ids)
+
+    def __maybe_train(self):
+        if self.__changes > self.__retrain * self.__trained:
+            self.train()
+            return True
+        return False
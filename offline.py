@@ -0,0 +1,145 @@
+import os
+import numpy as np
+from utils import sphere_sampling
+
+# Logs of a bandit in production are kept as a directory of npy arrays, one
+# entry per logged event: the arm pulled (0-based), its reward and the
+# probability with which the logging policy pulled it. The features of the
+# arms, one row per arm, are kept in arms.npy. Logs of contextual bandits
+# also keep the (events, arms, dim) contexts of the arms of every event in
+# contexts.npy.
+LOG_ARRAYS = ['actions', 'rewards', 'propensities']
+
+
+def write_logs(path, arms, actions, rewards, propensities, contexts=None):
+    """write logged events into the directory path"""
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'arms.npy'), np.asarray(arms, dtype=np.float64))
+    np.save(os.path.join(path, 'actions.npy'), np.asarray(actions, dtype=np.int64))
+    np.save(os.path.join(path, 'rewards.npy'), np.asarray(rewards, dtype=np.float64))
+    np.save(os.path.join(path, 'propensities.npy'), np.asarray(propensities, dtype=np.float64))
+    if contexts is not None:
+        np.save(os.path.join(path, 'contexts.npy'), np.asarray(contexts, dtype=np.float64))
+
+
+def log_uniform(path, bandit, arm_num, events, rng, chunk=100000):
+    """
+    log events of a uniformly random logging policy on a simulated bandit
+    with arms indexed from 0 (e.g. LinearBandit), for trying the evaluator
+    """
+    actions = rng.integers(arm_num, size=events)
+    rewards = np.concatenate([bandit.pull_many(actions[start:start + chunk])
+                              for start in range(0, events, chunk)])
+    arms = bandit.contexts if hasattr(bandit, 'contexts') else np.eye(arm_num)
+    write_logs(path, arms, actions, rewards, np.full(events, 1 / arm_num))
+
+
+def log_uniform_contexts(path, theta, arm_num, events, rng, sigma=1):
+    """
+    log events of a uniformly random logging policy on a linear bandit whose
+    arm_num arms get fresh contexts on the unit sphere every event, the
+    rewards being Gaussian around the inner products with theta
+    """
+    contexts = sphere_sampling(len(theta), events * arm_num, rng=rng).reshape(events, arm_num, len(theta))
+    actions = rng.integers(arm_num, size=events)
+    rewards = contexts[np.arange(events), actions] @ theta + sigma * rng.normal(size=events)
+    write_logs(path, np.eye(arm_num), actions, rewards, np.full(events, 1 / arm_num), contexts)
+
+
+def open_logs(path):
+    """memory-map the arrays of the logs in the directory path"""
+    logs = {name: np.load(os.path.join(path, '%s.npy' % name), mmap_mode='r') for name in LOG_ARRAYS}
+    logs['arms'] = np.load(os.path.join(path, 'arms.npy'))
+    if os.path.exists(os.path.join(path, 'contexts.npy')):
+        logs['contexts'] = np.load(os.path.join(path, 'contexts.npy'), mmap_mode='r')
+    if not len(logs['actions']) == len(logs['rewards']) == len(logs['propensities']) \
+            == len(logs.get('contexts', logs['actions'])):
+        raise Exception('Arrays of the logs in %s have different lengths!' % path)
+    return logs
+
+
+def read_chunks(paths, size):
+    """
+    yield the (actions, rewards, propensities, contexts) of the logs in the
+    directories paths, in order, as lists of at most size events, so that
+    only one chunk is read into memory at a time. contexts is an array of
+    the contexts of the arms of every event, or a list of None for logs
+    without contexts.
+    """
+    for path in paths:
+        logs = open_logs(path)
+        for start in range(0, len(logs['actions']), size):
+            chunk = tuple(logs[name][start:start + size].tolist() for name in LOG_ARRAYS)
+            if 'contexts' in logs:
+                yield chunk + (np.asarray(logs['contexts'][start:start + size]),)
+            else:
+                yield chunk + ([None] * len(chunk[0]),)
+
+
+class ReplayEvaluator():
+    """
+    Offline evaluation of a learner on logged events. The replay (rejection
+    sampling) estimator lets the learner choose on every event and only keeps
+    the events where it agrees with the logged action, which are fed back to
+    the learner as its next step; this is unbiased for a uniformly random
+    logging policy. The inverse propensity (IPS) estimate of the value of the
+    learner weighs the rewards of the agreeing events by 1 / propensity.
+    Rewards are recorded at the sorted horizons, starting with 0, up to T
+    steps of the learner.
+    offset is added to the logged actions to get the actions of the learner,
+    1 for the Bernoulli learners whose arms are 1 and 2. With rounds the
+    learner chooses among the logged contexts of every event by choose() and
+    learns the reward of the context by update_context(), as LinUCB does
+    after init_rounds(). With rng every event is offered a Poisson(1) number
+    of times (an online bootstrap of the logs), so that the runs of a
+    deterministic learner differ and still take one pass over the logs.
+    """
+
+    def __init__(self, learner, T, horizons, offset=0, rounds=False, rng=None):
+        self.__learner = learner
+        self.__rounds = rounds
+        self.__rng = rng
+        self.__T = T
+        self.__horizons = set(horizons)
+        self.__offset = offset
+        self.steps = 0
+        self.events = 0
+        self.rewards = 0
+        self.ips = 0
+        self.curve = [0]
+
+    @property
+    def learner(self):
+        return self.__learner
+
+    @property
+    def done(self):
+        return self.steps >= self.__T
+
+    def copies(self, events):
+        """numbers of times the next events are offered to the learner"""
+        if self.__rng is None:
+            return [1] * events
+        return self.__rng.poisson(size=events).tolist()
+
+    def feed(self, action, reward, propensity, contexts=None):
+        """replay one logged event, ignored once the learner made T steps"""
+        if self.steps >= self.__T:
+            return
+        self.events += 1
+        if self.__rounds:
+            if contexts is None:
+                raise Exception('The logs have no contexts to choose from!')
+            if self.__learner.choose(self.steps + 1, contexts) != action:
+                return
+            self.__learner.update_context(reward, contexts[action])
+        else:
+            action += self.__offset
+            if self.__learner.choice(self.steps + 1) != action:
+                return
+            self.__learner.update(reward, action)
+        self.steps += 1
+        self.rewards += reward
+        self.ips += reward / propensity
+        if self.steps in self.__horizons:
+            self.curve.append(self.rewards)
@@ -0,0 +1,95 @@
+import json
+import os
+from absl import logging
+from absl import flags
+import numpy as np
+from matplotlib.collections import PolyCollection
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+from utils import open_store
+
+sns.set()
+
+FLAGS = flags.FLAGS
+
+
+def paired_differences(df, baseline):
+    # subtract the regret of the baseline learner in the same trial and horizon,
+    # the i-th trial of every learner being run on the same reward tapes
+    base = df[df['learner'] == baseline][['trial', 'horizon', 'regret']]
+    df = df[df['learner'] != baseline].merge(base, on=['trial', 'horizon'], suffixes=('', '_base'))
+    df['regret'] -= df.pop('regret_base')
+
+    last = df[df['horizon'] == df['horizon'].max()].groupby('learner')['regret']
+    for learner, diff in last:
+        logging.info('%s - %s at horizon %d: %.3f +- %.3f (paired s.e.)'
+                     % (learner, baseline, df['horizon'].max(), diff.mean(), diff.std() / np.sqrt(len(diff))))
+    return df
+
+
+def read_results():
+    # read results of all trials from FLAGS.out, a json-lines file or a
+    # ResultStore directory, into a data frame with one row per regret
+    if os.path.isdir(FLAGS.out):
+        store = open_store(FLAGS.out)
+        frames = []
+        for learner in store.learners:
+            regrets = store.regrets(learner)
+            trials, horizons = regrets.shape
+            frames.append(pd.DataFrame({'learner': learner,
+                                        'trial': np.repeat(np.arange(trials), horizons),
+                                        'horizon': np.tile(store.horizons, trials),
+                                        'regret': regrets.reshape(-1)}))
+        return pd.concat(frames, ignore_index=True)
+
+    col_learners = []
+    col_trials = []
+    col_horizons = []
+    col_regrets = []
+    trial_counts = dict()
+    with open(FLAGS.out, 'r') as f:
+        for line in f:
+            one_trial = json.loads(line)
+            (learner, regrets) = list(one_trial.items())[0]
+            trial = trial_counts.get(learner, 0)
+            trial_counts[learner] = trial + 1
+            for horizon in regrets:
+                col_learners.append(learner)
+                col_trials.append(trial)
+                col_horizons.append(int(horizon))
+                col_regrets.append(regrets[horizon])
+
+    return pd.DataFrame({'learner': col_learners, 'trial': col_trials,
+                         'horizon': col_horizons, 'regret': col_regrets})
+
+
+def draw(baseline=None, ylabel='regret'):
+    # read results of trials from file FLAGS.out, calculate average empirical
+    # regret (or the recorded quantity named ylabel) for each policy and draw
+    # the final figure. With a baseline learner the paired differences of
+    # regrets to the baseline are drawn instead
+    df = read_results()
+    if baseline:
+        if baseline not in set(df['learner']):
+            logging.fatal('Unknown baseline learner %s!' % baseline)
+        df = paired_differences(df, baseline)
+        ylabel = 'regret - regret of %s' % baseline
+
+    if FLAGS.novar:
+        ci_val = None
+    else:
+        ci_val = 'sd'
+
+    ax = sns.lineplot(
+        x='horizon', y='regret', hue='learner', data=df, ci=ci_val)
+
+    # hide edges of filled area
+    for child in ax.findobj(PolyCollection):
+        child.set_linewidth(0.0)
+
+    plt.ylabel(ylabel, fontweight='bold', fontsize=15)
+    plt.xlabel('horizon', fontweight='bold', fontsize=15)
+    logging.info('output figure to %s' % FLAGS.fig)
+    plt.savefig(FLAGS.fig, format='png')
+    plt.close()
@@ -0,0 +1,223 @@
+from time import perf_counter
+from learner import Learner
+
+# profiler of the (policy, trial) unit running in this process, None when
+# profiling is off so that instrument() leaves learners and bandits untouched
+_active = None
+
+
+class Profiler():
+    """
+    Accumulated wall time and call counts of the phases (init, choice, pull,
+    update, regret, trial, write, checkpoint) of every policy. With
+    sample_every > 0 the latency of every sample_every-th decision is put
+    into a histogram with power-of-two microsecond buckets, bucket k holding
+    the latencies in [2^(k-1), 2^k) us.
+    """
+
+    def __init__(self, sample_every=0):
+        self.policy = None
+        self.__sample_every = sample_every
+        self.__decisions = 0
+        self.__phases = dict()
+        self.__histograms = dict()
+
+    @property
+    def sample_every(self):
+        return self.__sample_every
+
+    @property
+    def policies(self):
+        return list(self.__phases)
+
+    def add(self, phase, seconds, calls=1):
+        # phases of the current policy, as [calls, seconds]
+        phases = self.__phases.setdefault(self.policy, dict())
+        total = phases.get(phase)
+        if total is None:
+            phases[phase] = [calls, seconds]
+        else:
+            total[0] += calls
+            total[1] += seconds
+
+    def decision(self, seconds):
+        """add the latency of one choice, sampled into the histogram"""
+        self.add('choice', seconds)
+        if self.__sample_every > 0:
+            self.__decisions += 1
+            if self.__decisions % self.__sample_every == 0:
+                histogram = self.__histograms.setdefault(self.policy, dict())
+                bucket = int(seconds * 1e6).bit_length()
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def state(self):
+        """get the picklable and json serializable statistics"""
+        return {'sample_every': self.__sample_every,
+                'phases': {policy: {phase: list(total) for phase, total in phases.items()}
+                           for policy, phases in self.__phases.items()},
+                'histograms': {policy: {str(bucket): count for bucket, count in sorted(histogram.items())}
+                               for policy, histogram in self.__histograms.items()}}
+
+    def merge(self, state):
+        """add the statistics of another profiler, e.g. of a unit run by a worker"""
+        current = self.policy
+        for policy, phases in state['phases'].items():
+            self.policy = policy
+            for phase, (calls, seconds) in phases.items():
+                self.add(phase, seconds, calls)
+        self.policy = current
+        for policy, histogram in state['histograms'].items():
+            merged = self.__histograms.setdefault(policy, dict())
+            for bucket, count in histogram.items():
+                merged[int(bucket)] = merged.get(int(bucket), 0) + count
+
+    def table(self, policy):
+        """
+        rows (phase, calls, seconds, us per call, share) of policy, where the
+        share is taken of the time of trials, writes and checkpoints, and
+        'other' is the time of trials outside the instrumented calls
+        """
+        phases = self.__phases.get(policy, dict())
+        inner = sum(seconds for phase, (_, seconds) in phases.items()
+                    if phase not in ('trial', 'write', 'checkpoint'))
+        total = sum(phases[phase][1] for phase in ('trial', 'write', 'checkpoint') if phase in phases)
+        rows = [(phase, calls, seconds) for phase, (calls, seconds) in phases.items()]
+        if 'trial' in phases:
+            rows.append(('other', phases['trial'][0], phases['trial'][1] - inner))
+        return [(phase, calls, seconds, seconds / calls * 1e6 if calls else 0,
+                 seconds / total if total else 0) for phase, calls, seconds in rows]
+
+    def histogram(self, policy):
+        """sampled decision latencies of policy as sorted (upper bound in us, count)"""
+        return [(2 ** bucket, count) for bucket, count in sorted(self.__histograms.get(policy, dict()).items())]
+
+
+class ProfiledLearner(Learner):
+    """
+    A learner timing init, choice and update (also init_rounds and the
+    decisions and updates of per-round candidates) of the wrapped learner
+    into the active profiler. The snapshot methods and other attributes are
+    passed through.
+    """
+
+    def __init__(self, learner, profiler):
+        self.__learner = learner
+        self.__profiler = profiler
+
+    @property
+    def name(self):
+        return self.__learner.name
+
+    def init(self, *args):
+        start = perf_counter()
+        self.__learner.init(*args)
+        self.__profiler.add('init', perf_counter() - start)
+
+    def init_rounds(self, dim, arm_num):
+        start = perf_counter()
+        self.__learner.init_rounds(dim, arm_num)
+        self.__profiler.add('init', perf_counter() - start)
+
+    def choice(self, time):
+        start = perf_counter()
+        action = self.__learner.choice(time)
+        self.__profiler.decision(perf_counter() - start)
+        return action
+
+    def update(self, reward, action):
+        start = perf_counter()
+        self.__learner.update(reward, action)
+        self.__profiler.add('update', perf_counter() - start)
+
+    def choose(self, time, contexts):
+        start = perf_counter()
+        action = self.__learner.choose(time, contexts)
+        self.__profiler.decision(perf_counter() - start)
+        return action
+
+    def choose_index(self, time, index, k):
+        start = perf_counter()
+        action = self.__learner.choose_index(time, index, k)
+        self.__profiler.decision(perf_counter() - start)
+        return action
+
+    def update_context(self, reward, context):
+        start = perf_counter()
+        self.__learner.update_context(reward, context)
+        self.__profiler.add('update', perf_counter() - start)
+
+    def choose_batch(self, time, n):
+        start = perf_counter()
+        actions = self.__learner.choose_batch(time, n)
+        self.__profiler.add('choice', perf_counter() - start, n)
+        return actions
+
+    def update_batch(self, actions, rewards):
+        start = perf_counter()
+        self.__learner.update_batch(actions, rewards)
+        self.__profiler.add('update', perf_counter() - start, len(actions))
+
+    def get_state(self):
+        return self.__learner.get_state()
+
+    def set_state(self, state):
+        self.__learner.set_state(state)
+
+    def merge_state(self, state):
+        self.__learner.merge_state(state)
+
+    def __getattr__(self, name):
+        return getattr(self.__learner, name)
+
+
+class ProfiledBandit():
+    """
+    A bandit timing the pulls and the regret bookkeeping of the wrapped
+    bandit into the active profiler. Other attributes are passed through.
+    """
+
+    def __init__(self, bandit, profiler):
+        self.__bandit = bandit
+        self.__profiler = profiler
+
+    def pull_arm(self, index):
+        start = perf_counter()
+        reward = self.__bandit.pull_arm(index)
+        self.__profiler.add('pull', perf_counter() - start)
+        return reward
+
+    def pull_many(self, indices):
+        start = perf_counter()
+        rewards = self.__bandit.pull_many(indices)
+        self.__profiler.add('pull', perf_counter() - start, len(indices))
+        return rewards
+
+    def regret(self, rewards):
+        start = perf_counter()
+        regret = self.__bandit.regret(rewards)
+        self.__profiler.add('regret', perf_counter() - start)
+        return regret
+
+    def __getattr__(self, name):
+        return getattr(self.__bandit, name)
+
+
+def enable(sample_every=0):
+    """start profiling the units run in this process with a fresh profiler"""
+    global _active
+    _active = Profiler(sample_every)
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def instrument(obj):
+    """wrap a learner or a bandit into a timing proxy while profiling is on"""
+    if _active is None:
+        return obj
+    if isinstance(obj, Learner):
+        return ProfiledLearner(obj, _active)
+    return ProfiledBandit(obj, _active)
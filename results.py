@@ -0,0 +1,297 @@
+import json
+import os
+import shutil
+import numpy as np
+
+
+class ResultStore():
+    """
+    Columnar store of regret curves in the directory path. horizons.npy holds
+    the reported horizons and <learner>.npy a preallocated (capacity, horizons)
+    array with one row of regrets per trial, written through a memory map and
+    grown by doubling. meta.json records the learners in order of appearance
+    and the number of rows written for each of them.
+    """
+
+    def __init__(self, path):
+        self.__path = path
+        self.__maps = dict()
+        self.__rows = dict()
+        self.__horizons = None
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self.__file('meta.json')):
+            with open(self.__file('meta.json'), 'r') as f:
+                self.__rows = json.load(f)['rows']
+            self.__horizons = np.load(self.__file('horizons.npy'))
+
+    def __file(self, name):
+        return os.path.join(self.__path, name)
+
+    def __map(self, learner, rows):
+        # the memory map of a learner with room for at least rows trials
+        regrets = self.__maps.get(learner)
+        if regrets is None and learner in self.__rows:
+            regrets = np.load(self.__file('%s.npy' % learner), mmap_mode='r+')
+        if regrets is None or len(regrets) < rows:
+            capacity = max(rows, 2 * (0 if regrets is None else len(regrets)), 16)
+            grown = np.lib.format.open_memmap(self.__file('%s.npy.tmp' % learner), mode='w+',
+                                              dtype=np.float64, shape=(capacity, len(self.__horizons)))
+            if regrets is not None:
+                grown[:len(regrets)] = regrets
+                del regrets
+            grown.flush()
+            os.replace(self.__file('%s.npy.tmp' % learner), self.__file('%s.npy' % learner))
+            regrets = grown
+        self.__maps[learner] = regrets
+        return regrets
+
+    @property
+    def learners(self):
+        return list(self.__rows)
+
+    @property
+    def horizons(self):
+        return self.__horizons
+
+    def append(self, learner, horizons, regrets):
+        """append trials to learner, regrets being of shape (trials, len(horizons))"""
+        horizons = np.asarray(horizons, dtype=np.int64)
+        regrets = np.atleast_2d(regrets)
+        if self.__horizons is None:
+            self.__horizons = horizons
+            np.save(self.__file('horizons.npy'), horizons)
+        elif not np.array_equal(self.__horizons, horizons):
+            raise Exception('All trials in a store have to report the same horizons!')
+
+        start = self.__rows.get(learner, 0)
+        array = self.__map(learner, start + len(regrets))
+        array[start:start + len(regrets)] = regrets
+        array.flush()
+        self.__rows[learner] = start + len(regrets)
+        self.flush()
+
+    def truncate(self, rows):
+        """keep only the first rows[learner] trials of every learner"""
+        self.__rows = {learner: min(self.__rows[learner], rows.get(learner, 0))
+                       for learner in self.__rows if rows.get(learner, 0) > 0}
+        self.flush()
+
+    def flush(self):
+        with open(self.__file('meta.json.tmp'), 'w') as f:
+            json.dump({'rows': self.__rows}, f)
+        os.replace(self.__file('meta.json.tmp'), self.__file('meta.json'))
+
+    def regrets(self, learner):
+        """get a read-only, zero-copy (trials, horizons) view of the regrets of learner"""
+        array = np.load(self.__file('%s.npy' % learner), mmap_mode='r')
+        return array[:self.__rows[learner]]
+
+    def export_json(self, path):
+        """write all trials in the json-lines format of utils.write_to_file"""
+        horizons = self.__horizons.tolist()
+        with open(path, 'w') as f:
+            for learner in self.learners:
+                for row in self.regrets(learner):
+                    json.dump({learner: dict(zip(horizons, row.tolist()))}, f)
+                    f.write('\n')
+
+
+def action_dtype(arm_num):
+    """the smallest unsigned integer dtype holding the arms 0 to arm_num-1"""
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if arm_num <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class TraceStore():
+    """
+    Store of the actions chosen by every learner in the directory path, for
+    computing regrets and pulls of arms afterwards. <learner>.npy holds a
+    preallocated (capacity, envs, T) array of 0-based arms with the smallest
+    unsigned dtype, row i being trial i, and <learner>.means.npy the true
+    means of the arms of every (trial, environment) as (capacity, envs, K).
+    Both are written through memory maps and grown by doubling, and meta.json
+    records the number of rows of every learner.
+    """
+
+    def __init__(self, path):
+        self.__path = path
+        self.__maps = dict()
+        self.__rows = dict()
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self.__file('meta.json')):
+            with open(self.__file('meta.json'), 'r') as f:
+                self.__rows = json.load(f)['rows']
+
+    def __file(self, name):
+        return os.path.join(self.__path, name)
+
+    def __grow(self, name, array, rows, dtype, shape):
+        # a memory map of the npy file name with room for at least rows trials
+        if array is None and os.path.exists(self.__file(name)):
+            array = np.load(self.__file(name), mmap_mode='r+')
+        if array is None or len(array) < rows:
+            capacity = max(rows, 2 * (0 if array is None else len(array)), 16)
+            grown = np.lib.format.open_memmap(self.__file(name + '.tmp'), mode='w+', dtype=dtype,
+                                              shape=(capacity,) + shape)
+            if array is not None:
+                grown[:len(array)] = array
+                del array
+            grown.flush()
+            os.replace(self.__file(name + '.tmp'), self.__file(name))
+            array = grown
+        return array
+
+    @property
+    def learners(self):
+        return list(self.__rows)
+
+    def write(self, learner, trial, actions, means):
+        """write the (envs, T) 0-based actions and the (envs, K) means of the arms of one trial"""
+        actions, means = np.asarray(actions), np.asarray(means, dtype=np.float64)
+        maps = self.__maps.get(learner, (None, None))
+        maps = (self.__grow('%s.npy' % learner, maps[0], trial + 1, action_dtype(means.shape[-1]), actions.shape),
+                self.__grow('%s.means.npy' % learner, maps[1], trial + 1, np.float64, means.shape))
+        maps[0][trial] = actions
+        maps[1][trial] = means
+        self.__maps[learner] = maps
+        self.__rows[learner] = max(self.__rows.get(learner, 0), trial + 1)
+        self.flush()
+
+    def flush(self):
+        for maps in self.__maps.values():
+            for array in maps:
+                array.flush()
+        with open(self.__file('meta.json.tmp'), 'w') as f:
+            json.dump({'rows': self.__rows}, f)
+        os.replace(self.__file('meta.json.tmp'), self.__file('meta.json'))
+
+    def actions(self, learner):
+        """get a read-only, zero-copy (trials, envs, T) view of the actions of learner"""
+        return np.load(self.__file('%s.npy' % learner), mmap_mode='r')[:self.__rows[learner]]
+
+    def means(self, learner):
+        return np.load(self.__file('%s.means.npy' % learner), mmap_mode='r')[:self.__rows[learner]]
+
+
+def pseudo_regrets(actions, means, horizons):
+    """
+    expected regrets at the horizons of the (..., T) actions, means being the
+    (..., K) true means of the arms, from one cumulative sum of the gaps
+    """
+    gaps = means.max(axis=-1, keepdims=True) - means
+    cumulative = np.concatenate([np.zeros(actions.shape[:-1] + (1,)),
+                                 np.cumsum(np.take_along_axis(gaps, actions.astype(np.intp), axis=-1), axis=-1)],
+                                axis=-1)
+    return cumulative[..., np.asarray(horizons)]
+
+
+def pull_fractions(actions, arm_num, horizons):
+    """shares of the first h steps spent on every arm for every horizon h, of shape (..., len(horizons), K)"""
+    horizons = np.asarray(horizons)
+    fractions = np.zeros(actions.shape[:-1] + (len(horizons), arm_num))
+    for arm in range(arm_num):
+        counts = np.concatenate([np.zeros(actions.shape[:-1] + (1,)), np.cumsum(actions == arm, axis=-1)], axis=-1)
+        fractions[..., arm] = counts[..., horizons] / np.maximum(horizons, 1)
+    return fractions
+
+
+def remove_results(path):
+    # remove previously generated data, a json-lines file or a store directory
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class RegretAggregator():
+    """
+    Streaming statistics of the regrets of every (learner, horizon): running
+    mean and sum of squared deviations (Welford), min and max (the max of the
+    per-trial minimax regrets), in O(#horizons) memory per learner. The set of
+    completed trials is kept so that a run can be checkpointed and resumed.
+    """
+
+    def __init__(self):
+        self.__horizons = None
+        self.__stats = dict()
+        self.__done = dict()
+        self.extra = dict()
+
+    @property
+    def learners(self):
+        return list(self.__stats)
+
+    @property
+    def horizons(self):
+        return self.__horizons
+
+    def done(self, learner, trial):
+        return trial in self.__done.get(learner, ())
+
+    def trials(self, learner):
+        return len(self.__done.get(learner, ()))
+
+    def add(self, learner, trial, regrets):
+        """add one trial, regrets being a dict from horizons to regrets"""
+        self.add_many(learner, [trial], list(regrets), [list(regrets.values())])
+
+    def add_many(self, learner, trials, horizons, regrets):
+        """add many trials at once, regrets being of shape (len(trials), len(horizons))"""
+        horizons = np.asarray(horizons, dtype=np.int64)
+        regrets = np.asarray(regrets, dtype=np.float64)
+        if self.__horizons is None:
+            self.__horizons = horizons
+        elif not np.array_equal(self.__horizons, horizons):
+            raise Exception('All trials have to report the same horizons!')
+
+        # merge the statistics of the new trials with the running ones
+        count, mean = len(regrets), regrets.mean(axis=0)
+        m2 = ((regrets - mean) ** 2).sum(axis=0)
+        stats = self.__stats.get(learner)
+        if stats is None:
+            stats = {'count': 0, 'mean': np.zeros(len(horizons)), 'm2': np.zeros(len(horizons)),
+                     'min': np.full(len(horizons), np.inf), 'max': np.full(len(horizons), -np.inf)}
+            self.__stats[learner] = stats
+        total = stats['count'] + count
+        delta = mean - stats['mean']
+        stats['mean'] = stats['mean'] + delta * count / total
+        stats['m2'] = stats['m2'] + m2 + delta ** 2 * stats['count'] * count / total
+        stats['count'] = total
+        stats['min'] = np.minimum(stats['min'], regrets.min(axis=0))
+        stats['max'] = np.maximum(stats['max'], regrets.max(axis=0))
+        self.__done.setdefault(learner, set()).update(int(trial) for trial in trials)
+
+    def summary(self, learner):
+        """get count, mean, std, min and max of the regrets of learner at every horizon"""
+        stats = self.__stats[learner]
+        std = np.sqrt(stats['m2'] / max(stats['count'] - 1, 1))
+        return {'count': stats['count'], 'mean': stats['mean'], 'std': std,
+                'min': stats['min'], 'max': stats['max']}
+
+    def save(self, path):
+        """checkpoint the statistics and completed trials into the json file path"""
+        data = {'horizons': None if self.__horizons is None else self.__horizons.tolist(),
+                'stats': {learner: {key: value.tolist() if isinstance(value, np.ndarray) else value
+                                    for key, value in stats.items()}
+                          for learner, stats in self.__stats.items()},
+                'done': {learner: sorted(trials) for learner, trials in self.__done.items()},
+                'extra': self.extra}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+        aggregator = cls()
+        if data['horizons'] is not None:
+            aggregator.__horizons = np.array(data['horizons'], dtype=np.int64)
+        aggregator.__stats = {learner: {key: value if key == 'count' else np.array(value, dtype=np.float64)
+                                        for key, value in stats.items()}
+                              for learner, stats in data['stats'].items()}
+        aggregator.__done = {learner: set(trials) for learner, trials in data['done'].items()}
+        aggregator.extra = data['extra']
+        return aggregator
@@ -0,0 +1,75 @@
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import numpy as np
+import profiler
+
+
+def unit_seed(seed, policy_index, trial):
+    """derive the seed of one (policy, trial) work unit from the master seed"""
+    return int(np.random.SeedSequence(seed, spawn_key=(policy_index, trial)).generate_state(1)[0])
+
+
+def env_seed(seed, policy_index, trial, crn=False):
+    """
+    derive the seed of the bandits of one work unit from the master seed. With
+    common random numbers (crn) it depends on the trial only, so that every
+    policy of a trial replays the same reward tapes.
+    """
+    key = (trial,) if crn else (policy_index, trial, 0)
+    return int(np.random.SeedSequence(seed, spawn_key=key).generate_state(1)[0])
+
+
+def _run_unit(unit):
+    # every unit gets its own random stream, so the results do not depend on
+    # which worker runs it or what ran before it
+    trial_fn, policy, seed, bandit_seed, profile = unit
+    np.random.seed(seed)
+    if profile is None:
+        return trial_fn(policy, np.random.default_rng(bandit_seed))
+
+    # profile the unit with a fresh profiler whose statistics travel back with
+    # the result, so that units run by workers are accounted too
+    unit_profiler = profiler.enable(profile)
+    unit_profiler.policy = policy.name
+    start = perf_counter()
+    result = trial_fn(profiler.instrument(policy), np.random.default_rng(bandit_seed))
+    unit_profiler.add('trial', perf_counter() - start)
+    profiler.disable()
+    return result, unit_profiler.state()
+
+
+def _collect(result, totals):
+    # split off the profile of a unit and merge it into totals
+    if totals is None:
+        return result
+    result, state = result
+    totals.merge(state)
+    return result
+
+
+def run_trials(trial_fn, policies, trials, seed, workers=1, crn=False, skip=None, totals=None):
+    """
+    Run trial_fn(policy, rng) for every policy and trial, where rng is the
+    generator of the bandits, and yield the tuples (policy, trial, result)
+    ordered by policy then trial. Units for which skip(policy, trial) is true
+    are left out. With workers > 1 the units are fanned out over a process
+    pool, so trial_fn and the policies must be picklable. With a profiler as
+    totals, every unit is profiled, sampling every totals.sample_every-th
+    decision, and its statistics are merged into totals.
+    """
+    keys = [(i, policy, trial) for i, policy in enumerate(policies) for trial in range(trials)
+            if skip is None or not skip(policy, trial)]
+    profile = None if totals is None else totals.sample_every
+    units = [(trial_fn, policy, unit_seed(seed, i, trial), env_seed(seed, i, trial, crn), profile)
+             for i, policy, trial in keys]
+    keys = [(policy, trial) for _, policy, trial in keys]
+
+    if workers <= 1:
+        for (policy, trial), unit in zip(keys, units):
+            yield policy, trial, _collect(_run_unit(unit), totals)
+        return
+
+    chunksize = max(1, len(units) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for (policy, trial), result in zip(keys, executor.map(_run_unit, units, chunksize=chunksize)):
+            yield policy, trial, _collect(result, totals)
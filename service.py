@@ -0,0 +1,318 @@
+import asyncio
+import collections
+import json
+import time
+from absl import app
+from absl import logging
+from absl import flags
+import numpy as np
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('host', '127.0.0.1', 'address of the decision service')
+flags.DEFINE_integer('port', 8765, 'port of the decision service')
+flags.DEFINE_enum('policy', 'UCB', ['Greedy', 'Epsilon-Greedy', 'UCB', 'TS'], 'learner served')
+flags.DEFINE_float('eps', 1, 'parameter epsilon for epsilon greedy algorithm')
+flags.DEFINE_float('alpha', 0.5, 'parameter alpha for UCB algorithm')
+flags.DEFINE_integer('max_batch', 64, 'maximal number of requests applied in one micro-batch')
+flags.DEFINE_float('max_latency_ms', 1, 'maximal milliseconds a request waits for its micro-batch to fill')
+flags.DEFINE_integer('clients', 0, 'number of local clients to run against the service, 0 to serve only')
+flags.DEFINE_integer('requests', 10000, 'number of decisions made by the local clients')
+flags.DEFINE_float('prob', 0.2, 'the true probability of the first arm of the local clients')
+flags.DEFINE_integer('seed', 0, 'seed of the learner and the local clients')
+
+
+class DecisionService():
+    """
+    Serve choice() and update() of a learner to many concurrent callers of
+    one event loop. Requests are queued and applied in micro-batches of at
+    most max_batch requests, a batch waiting at most max_latency seconds for
+    more requests: first the rewards of the batch through update_batch(),
+    then all its decisions through one choose_batch(). The learner has to be
+    initialized before the service is started. Updates of actions that are
+    not integers or not in arms (if given) are rejected, and the requests of a batch the learner
+    fails on get its exception.
+    """
+
+    def __init__(self, learner, max_batch=64, max_latency=0.001, window=100000, arms=None):
+        self.__learner = learner
+        self.__arms = arms
+        self.__max_batch = max_batch
+        self.__max_latency = max_latency
+        self.__queue = None
+        self.__task = None
+        # requests taken off the queue and not answered yet
+        self.__batch = []
+        self.__time = 1
+        self.__start = None
+        self.__counts = {'choice': 0, 'update': 0, 'batches': 0}
+        # latencies of the last window requests of each kind
+        self.__latencies = {'choice': collections.deque(maxlen=window),
+                            'update': collections.deque(maxlen=window)}
+
+    async def start(self):
+        self.__queue = asyncio.Queue()
+        self.__start = time.perf_counter()
+        self.__task = asyncio.get_running_loop().create_task(self.__run())
+
+    async def stop(self):
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+        for request in self.__batch:
+            request[2].cancel()
+        while not self.__queue.empty():
+            self.__queue.get_nowait()[2].cancel()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def choice(self):
+        """get an action from the learner"""
+        return await self.__submit('choice', None)
+
+    async def update(self, reward, action):
+        """feed back the reward of an action, returning once it is applied"""
+        await self.__submit('update', (action, reward))
+
+    def __submit(self, kind, payload):
+        future = asyncio.get_running_loop().create_future()
+        self.__queue.put_nowait((kind, payload, future, time.perf_counter()))
+        return future
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        queue = self.__queue
+        while True:
+            batch = self.__batch = [await queue.get()]
+            deadline = loop.time() + self.__max_latency
+            while True:
+                while len(batch) < self.__max_batch and not queue.empty():
+                    batch.append(queue.get_nowait())
+                remaining = deadline - loop.time()
+                if len(batch) >= self.__max_batch or remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+                deadline = loop.time()
+            try:
+                self.__apply(batch)
+            except Exception as e:
+                # fail the requests of this batch only and keep serving
+                for request in batch:
+                    if not request[2].done():
+                        request[2].set_exception(e)
+            self.__batch = []
+
+    def __valid(self, action):
+        # actions are arm numbers, e.g. not 1.0 or True of a json request
+        if not isinstance(action, (int, np.integer)) or isinstance(action, bool):
+            return False
+        return self.__arms is None or action in self.__arms
+
+    def __apply(self, batch):
+        choices = [request for request in batch if request[0] == 'choice']
+        updates = []
+        for request in batch:
+            if request[0] != 'update':
+                continue
+            if self.__valid(request[1][0]):
+                updates.append(request)
+            elif not request[2].done():
+                request[2].set_exception(Exception('Unknown action %s!' % (request[1][0],)))
+        if updates:
+            self.__learner.update_batch([request[1][0] for request in updates],
+                                        [request[1][1] for request in updates])
+        actions = self.__learner.choose_batch(self.__time, len(choices)) if choices else []
+        self.__time += len(choices)
+
+        now = time.perf_counter()
+        for request, result in zip(updates + choices, [None] * len(updates) + list(actions)):
+            kind, _, future, start = request
+            if not future.done():
+                future.set_result(result)
+            self.__latencies[kind].append(now - start)
+            self.__counts[kind] += 1
+        self.__counts['batches'] += 1
+
+    def metrics(self):
+        """throughput since the start, mean batch size and latency percentiles in milliseconds"""
+        elapsed = time.perf_counter() - self.__start
+        metrics = {'decisions_per_sec': self.__counts['choice'] / elapsed,
+                   'updates_per_sec': self.__counts['update'] / elapsed,
+                   'batches': self.__counts['batches'],
+                   'mean_batch': (self.__counts['choice'] + self.__counts['update'])
+                   / max(self.__counts['batches'], 1)}
+        for kind, latencies in self.__latencies.items():
+            if latencies:
+                p50, p99 = np.percentile(np.array(latencies), [50, 99]) * 1e3
+                metrics['%s_p50_ms' % kind] = p50
+                metrics['%s_p99_ms' % kind] = p99
+        return metrics
+
+    async def __handle(self, request):
+        # answer one request of the json lines protocol
+        if request['op'] == 'choice':
+            return {'action': await self.choice()}
+        elif request['op'] == 'update':
+            await self.update(request['reward'], request['action'])
+            return {}
+        elif request['op'] == 'metrics':
+            return {'metrics': self.metrics()}
+        raise Exception('Unknown operation %s!' % request['op'])
+
+    async def __connection(self, reader, writer):
+        # every line is handled in its own task, so that the pipelined
+        # requests of one connection are batched together as well
+        async def respond(request):
+            try:
+                response = await self.__handle(request)
+            except Exception as e:
+                response = {'error': str(e)}
+            response['id'] = request.get('id')
+            writer.write((json.dumps(response) + '\n').encode())
+
+        tasks = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            task = asyncio.get_running_loop().create_task(respond(json.loads(line)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def serve(self, host, port):
+        """
+        serve the learner on a local socket, one json object per line:
+        {"op": "choice"} is answered by {"action": ...}, {"op": "update",
+        "action": ..., "reward": ...} by {} once applied and {"op":
+        "metrics"} by {"metrics": ...}. An "id" of a request is echoed back.
+        """
+        return await asyncio.start_server(self.__connection, host, port)
+
+
+class DecisionClient():
+    """
+    Client of a DecisionService served on a socket. Requests of concurrent
+    callers are pipelined over one connection and matched by their ids, and
+    fail with ConnectionError once the connection is closed.
+    """
+
+    def __init__(self, host, port):
+        self.__host = host
+        self.__port = port
+        self.__pending = dict()
+        self.__next_id = 0
+
+    async def connect(self):
+        self.__reader, self.__writer = await asyncio.open_connection(self.__host, self.__port)
+        self.__task = asyncio.get_running_loop().create_task(self.__receive())
+
+    async def close(self):
+        self.__writer.close()
+        await self.__task
+
+    async def __receive(self):
+        try:
+            while True:
+                line = await self.__reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.__pending.pop(response.pop('id'))
+                if 'error' in response:
+                    future.set_exception(Exception(response['error']))
+                else:
+                    future.set_result(response)
+        finally:
+            # no more responses come, so fail the requests still waiting
+            for future in self.__pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection to the decision service closed!'))
+            self.__pending.clear()
+
+    async def __request(self, request):
+        if self.__task.done():
+            raise ConnectionError('Connection to the decision service closed!')
+        request['id'] = self.__next_id
+        self.__next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[request['id']] = future
+        self.__writer.write((json.dumps(request) + '\n').encode())
+        return await future
+
+    async def choice(self):
+        return (await self.__request({'op': 'choice'}))['action']
+
+    async def update(self, reward, action):
+        await self.__request({'op': 'update', 'action': action, 'reward': reward})
+
+    async def metrics(self):
+        return (await self.__request({'op': 'metrics'}))['metrics']
+
+
+def make_learner():
+    # the learner selected by FLAGS.policy, initialized
+    from learner import Greedy, EpsGreedy, BerUCB, TS
+    learners = {'Greedy': Greedy, 'Epsilon-Greedy': lambda: EpsGreedy(FLAGS.eps),
+                'UCB': lambda: BerUCB(FLAGS.alpha), 'TS': TS}
+    learner = learners[FLAGS.policy]()
+    learner.init()
+    return learner
+
+
+async def run_clients(host, port):
+    # FLAGS.clients concurrent clients play Bernoulli arms through the service
+    from bandit import BernoulliBandit
+    bandit = BernoulliBandit(FLAGS.prob, 1 - FLAGS.prob, rng=np.random.default_rng(FLAGS.seed))
+    bandit.init()
+    counter = iter(range(FLAGS.requests))
+    rewards = []
+
+    async def play():
+        client = DecisionClient(host, port)
+        await client.connect()
+        for _ in counter:
+            action = await client.choice()
+            reward = bandit.pull_arm(action)
+            rewards.append(reward)
+            await client.update(reward, action)
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[play() for _ in range(FLAGS.clients)])
+    elapsed = time.perf_counter() - start
+    logging.info('%d clients made %d decisions in %.2f s, regret %.1f'
+                 % (FLAGS.clients, FLAGS.requests, elapsed, bandit.regret(sum(rewards))))
+
+
+async def serve():
+    np.random.seed(FLAGS.seed)
+    learner = make_learner()
+    service = DecisionService(learner, FLAGS.max_batch, FLAGS.max_latency_ms / 1e3, arms=range(1, learner.arm_num + 1))
+    async with service:
+        server = await service.serve(FLAGS.host, FLAGS.port)
+        logging.info('serve %s on %s:%d' % (FLAGS.policy, FLAGS.host, FLAGS.port))
+        async with server:
+            if FLAGS.clients == 0:
+                await server.serve_forever()
+            await run_clients(FLAGS.host, FLAGS.port)
+        for key, value in service.metrics().items():
+            logging.info('%s: %.3f' % (key, value))
+
+
+def main(argv):
+    del argv
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,97 @@
+import json
+import os
+import struct
+import numpy as np
+
+# A snapshot file starts with MAGIC, the format version and the length of a
+# json header (struct HEADER), followed by the header and the raw arrays of the
+# state, each starting at a multiple of ALIGN bytes so that it can be
+# memory-mapped. The header records the learner and, for every array, its
+# dtype, shape and offset, while scalars of the state are kept in the header.
+MAGIC = b'BNDTSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sHI')
+ALIGN = 64
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def save_snapshot(learner, path):
+    """write the state of learner into the snapshot file path, atomically"""
+    state = learner.get_state()
+    arrays = {key: np.ascontiguousarray(value) for key, value in state.items() if isinstance(value, np.ndarray)}
+    header = {'learner': learner.name, 'class': type(learner).__name__,
+              'scalars': {key: value for key, value in state.items() if key not in arrays},
+              'arrays': dict()}
+
+    # offsets are relative to the end of the header, so that they do not
+    # depend on its length
+    offset = 0
+    for key, array in arrays.items():
+        header['arrays'][key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    encoded = json.dumps(header).encode()
+    start = _aligned(HEADER.size + len(encoded))
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        for key, array in arrays.items():
+            f.seek(start + header['arrays'][key]['offset'])
+            f.write(array.data)
+        f.truncate(start + offset)
+    os.replace(path + '.tmp', path)
+
+
+def read_snapshot(path, mmap=False):
+    """
+    read the header and the state of the snapshot file path. With mmap the
+    arrays are memory-mapped copy on write, so loading costs no reads up
+    front and updates of the restored learner stay in memory.
+    """
+    with open(path, 'rb') as f:
+        magic, version, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise Exception('%s is not a learner snapshot!' % path)
+        if version > VERSION:
+            raise Exception('Snapshot version %d of %s is newer than %d!' % (version, path, VERSION))
+        header = json.loads(f.read(length).decode())
+        start = _aligned(HEADER.size + length)
+
+        state = dict(header['scalars'])
+        for key, spec in header['arrays'].items():
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            if mmap and int(np.prod(shape)) > 0:
+                state[key] = np.memmap(path, dtype=dtype, mode='c', offset=start + spec['offset'], shape=shape)
+            else:
+                f.seek(start + spec['offset'])
+                state[key] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return header, state
+
+
+def _check(learner, header, path):
+    if header['class'] != type(learner).__name__ or header['learner'] != learner.name:
+        raise Exception('%s holds a snapshot of %s, not of %s!' % (path, header['class'], type(learner).__name__))
+
+
+def load_snapshot(learner, path, mmap=False):
+    """restore learner, constructed with the same hyper-parameters, from the snapshot file path"""
+    header, state = read_snapshot(path, mmap)
+    _check(learner, header, path)
+    learner.set_state(state)
+    return learner
+
+
+def merge_snapshots(learner, paths):
+    """
+    restore learner from the first snapshot and add the statistics of the
+    others, e.g. of shards trained in parallel from the same prior
+    """
+    load_snapshot(learner, paths[0])
+    for path in paths[1:]:
+        header, state = read_snapshot(path)
+        _check(learner, header, path)
+        learner.merge_state(state)
+    return learner
@@ -1,16 +1,14 @@
+import heapq
 import json
-from absl import logging
 from absl import flags
 import numpy as np
-from matplotlib.collections import PolyCollection
-import matplotlib.pyplot as plt
-import pandas as pd
-import seaborn as sns
-
-sns.set()
+from results import ResultStore
 
 FLAGS = flags.FLAGS
 
+# stores opened by write_to_file, keyed by their paths
+_stores = dict()
+
 
 class EmArm:
     """
@@ -52,51 +50,236 @@ class EmArm:
             self.__good_pulls += 1
 
 
-def draw():
-    # read results of trials from file FLAGS.out, calculate average empirical
-    # regret for each policy and draw the final figure
-    col_learners = []
-    col_horizons = []
-    col_regrets = []
-    with open(FLAGS.out, 'r') as f:
-        for line in f:
-            one_trial = json.loads(line)
-            (learner, regrets) = list(one_trial.items())[0]
-            for horizon in regrets:
-                col_learners.append(learner)
-                col_horizons.append(int(horizon))
-                col_regrets.append(regrets[horizon])
+class ArmStats:
+    """
+    The class for storing empirical information of many arms in contiguous
+    arrays (struct of arrays). With shape=K arm k is entry k of every array;
+    with shape=(trials, K) every trial is a row, as in the batch learners.
+    """
+
+    def __init__(self, shape, squares=False):
+        self.__shape = shape
+        self.__squares = squares
+        self.reset()
+
+    @property
+    def arm_num(self):
+        return self.__pulls.shape[-1]
+
+    @property
+    def rewards(self):
+        return self.__rewards
+
+    @property
+    def pulls(self):
+        return self.__pulls
+
+    @property
+    def good_pulls(self):
+        return self.__good_pulls
+
+    @property
+    def sq_rewards(self):
+        return self.__sq_rewards
+
+    @property
+    def em_mean(self):
+        """get empirical means of all arms (every arm has to be pulled first)"""
+        return self.__rewards / self.__pulls
+
+    def mean_or(self, default):
+        """get empirical means of all arms, default for the arms not pulled yet"""
+        return np.divide(self.__rewards, self.__pulls, out=np.full(self.__rewards.shape, float(default)),
+                         where=self.__pulls > 0)
+
+    def widths(self):
+        """get 1 / sqrt(pulls) of all arms, 0 for the arms not pulled yet"""
+        return np.divide(1, np.sqrt(self.__pulls), out=np.zeros(self.__pulls.shape), where=self.__pulls > 0)
 
-    df = pd.DataFrame({'learner': col_learners, 'horizon': col_horizons,
-                       'regret': col_regrets})
+    @property
+    def em_var(self):
+        """get empirical variances of all arms (squares=True only)"""
+        if self.__sq_rewards is None:
+            raise Exception('Sum of squares is not recorded!')
+        return self.__sq_rewards / self.__pulls - self.em_mean ** 2
 
-    if FLAGS.novar:
-        ci_val = None
-    else:
-        ci_val = 'sd'
+    def ucb(self, time, alpha):
+        """get upper confidence bounds of all arms at the given time"""
+        return self.em_mean + alpha * np.sqrt(2 * np.log(time - 1) / self.__pulls)
 
-    ax = sns.lineplot(
-        x='horizon', y='regret', hue='learner', data=df, ci=ci_val)
+    def posterior(self):
+        """get parameters of the Beta posteriors of all arms under a uniform prior"""
+        return 1 + self.__good_pulls, 1 + self.__pulls - self.__good_pulls
+
+    def reset(self):
+        """clear historical records"""
+        self.__pulls = np.zeros(self.__shape, dtype=np.int64)
+        self.__rewards = np.zeros(self.__shape)
+        self.__good_pulls = np.zeros(self.__shape, dtype=np.int64)
+        self.__sq_rewards = np.zeros(self.__shape) if self.__squares else None
 
-    # hide edges of filled area
-    for child in ax.findobj(PolyCollection):
-        child.set_linewidth(0.0)
+    def update(self, index, reward, good_pulls):
+        """
+        index is an arm, or a tuple of index arrays (rows, arms) together with
+        arrays of rewards and good pulls when updating many rows at once
+        """
+        self.__pulls[index] += 1
+        self.__rewards[index] += reward
+        self.__good_pulls[index] += good_pulls
+        if self.__squares:
+            self.__sq_rewards[index] += np.square(reward)
 
-    plt.ylabel('regret', fontweight='bold', fontsize=15)
-    plt.xlabel('horizon', fontweight='bold', fontsize=15)
-    logging.info('output figure to %s' % FLAGS.fig)
-    plt.savefig(FLAGS.fig, format='png')
-    plt.close()
+    def state(self):
+        """get the arrays of the statistics, e.g. for a snapshot"""
+        state = {'pulls': self.__pulls, 'rewards': self.__rewards, 'good_pulls': self.__good_pulls}
+        if self.__squares:
+            state['sq_rewards'] = self.__sq_rewards
+        return state
+
+    def load_state(self, state):
+        """take over the arrays of a state, which may be memory-mapped copy on write"""
+        if np.shape(state['pulls']) != self.__pulls.shape:
+            raise Exception('Cannot load statistics of %s arms into %s arms!'
+                            % (np.shape(state['pulls'])[-1], self.__pulls.shape[-1]))
+        self.__pulls = state['pulls']
+        self.__rewards = state['rewards']
+        self.__good_pulls = state['good_pulls']
+        if self.__squares:
+            self.__sq_rewards = state['sq_rewards']
+        self.__shape = self.__pulls.shape
+
+    def merge(self, state):
+        """add the statistics of another state, e.g. of a shard trained in parallel"""
+        if state['pulls'].shape != self.__pulls.shape:
+            raise Exception('Cannot merge statistics of different numbers of arms!')
+        self.__pulls = self.__pulls + state['pulls']
+        self.__rewards = self.__rewards + state['rewards']
+        self.__good_pulls = self.__good_pulls + state['good_pulls']
+        if self.__squares:
+            self.__sq_rewards = self.__sq_rewards + state['sq_rewards']
+
+    def update_many(self, arms, rewards, good_pulls):
+        """
+        update the statistics with many pulls at once (shape=K only), arms
+        being an array of pulled arms which may repeat
+        """
+        arm_num = self.arm_num
+        self.__pulls += np.bincount(arms, minlength=arm_num)
+        self.__rewards += np.bincount(arms, weights=rewards, minlength=arm_num)
+        self.__good_pulls += np.bincount(arms, weights=good_pulls, minlength=arm_num).astype(np.int64)
+        if self.__squares:
+            self.__sq_rewards += np.bincount(arms, weights=np.square(rewards), minlength=arm_num)
+
+
+class UCBHeap:
+    """
+    The class for selecting the arm with the largest UCB index among many
+    arms in amortised O(log K) time. Only the pulled arm changes between two
+    rounds apart from the log(t) bonus, which grows monotonically. So each arm
+    is kept in a max-heap keyed by its index at the end of the current epoch,
+    an upper bound of its index at any time of the epoch, and only arms whose
+    bound beats the best exact index found so far are recomputed. Keys are
+    rebuilt when an epoch ends, and epochs grow geometrically. Arms not pulled
+    yet, e.g. of restored statistics, have infinite indices.
+    """
+
+    def __init__(self, stats, alpha, growth=1.25):
+        self.__stats = stats
+        self.__alpha = alpha
+        self.__growth = growth
+        self.__epoch_end = 0
+        self.__heap = []
+        self.__versions = np.zeros(stats.arm_num, dtype=np.int64)
+
+    def __key(self, arm):
+        if not self.__stats.pulls[arm]:
+            return np.inf
+        return self.__stats.rewards[arm] / self.__stats.pulls[arm] + \
+            self.__alpha * np.sqrt(2 * np.log(self.__epoch_end - 1) / self.__stats.pulls[arm])
+
+    def __rebuild(self, time):
+        while self.__epoch_end < time:
+            self.__epoch_end = max(int(np.ceil(self.__epoch_end * self.__growth)), time, 3)
+        pulls = self.__stats.pulls
+        pulled = pulls > 0
+        keys = np.full(len(pulls), np.inf)
+        keys[pulled] = self.__stats.rewards[pulled] / pulls[pulled] + \
+            self.__alpha * np.sqrt(2 * np.log(self.__epoch_end - 1) / pulls[pulled])
+        self.__heap = list(zip((-keys).tolist(), self.__versions.tolist(), range(len(keys))))
+        heapq.heapify(self.__heap)
+
+    def update(self, arm):
+        """record that the statistics of arm have changed"""
+        self.__versions[arm] += 1
+        if self.__heap:
+            heapq.heappush(self.__heap, (-self.__key(arm), int(self.__versions[arm]), arm))
+
+    def argmax(self, time):
+        """get the arm with the largest UCB index at the given time"""
+        if time > self.__epoch_end:
+            self.__rebuild(time)
+        heap = self.__heap
+        width = self.__alpha * np.sqrt(2 * np.log(time - 1))
+        best_arm, best_upper = -1, -np.inf
+        popped = []
+        while heap:
+            neg_key, version, arm = heap[0]
+            if version != self.__versions[arm]:
+                # drop entries left behind by earlier updates of the arm
+                heapq.heappop(heap)
+                continue
+            if -neg_key <= best_upper:
+                break
+            popped.append(heapq.heappop(heap))
+            pulls = self.__stats.pulls[arm]
+            upper = self.__stats.rewards[arm] / pulls + width / np.sqrt(pulls) if pulls else np.inf
+            if upper > best_upper:
+                best_arm, best_upper = arm, upper
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return best_arm
+
+
+def draw(baseline=None, ylabel='regret'):
+    # the plotting stack is imported on first use only, so that learners,
+    # bandits and pool workers start without it
+    import plot
+    plot.draw(baseline, ylabel)
+
+
+def open_store(path):
+    # the ResultStore of a directory, kept open for the following writes
+    if path not in _stores:
+        _stores[path] = ResultStore(path)
+    return _stores[path]
 
 
 def write_to_file(data):
-    # write one trial result to file FLAGS.out
+    # write one trial result to file FLAGS.out, appended to a ResultStore
+    # directory if FLAGS.format is npy
+    if FLAGS.format == 'npy':
+        (learner, regrets), = data.items()
+        open_store(FLAGS.out).append(learner, list(regrets), [list(regrets.values())])
+        return
     with open(FLAGS.out, 'a') as f:
         json.dump(data, f)
         f.write('\n')
         f.flush()
 
 
-def sphere_sampling(dim, samples):
-    v = np.random.normal(size=(samples, dim))
-    return v / np.sqrt(np.sum(v ** 2, 0))
+def write_trials(learner, horizons, regrets):
+    # write results of many trials of a learner at once, regrets being an
+    # array of shape (trials, len(horizons))
+    if FLAGS.format == 'npy':
+        open_store(FLAGS.out).append(learner, horizons, regrets)
+        return
+    horizons = list(horizons)
+    for row in np.asarray(regrets).tolist():
+        write_to_file(dict({learner: dict(zip(horizons, row))}))
+
+
+def sphere_sampling(dim, samples, dtype=np.float64, rng=None):
+    # sample points uniformly on the unit sphere in dim dimensions, one per row,
+    # from the generator rng or the global numpy state
+    v = (np.random if rng is None else rng).normal(size=(samples, dim)).astype(dtype)
+    return v / np.sqrt(np.sum(v ** 2, 1, keepdims=True))